@@ -16,16 +16,34 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import sys
-import pkgutil
+import os
 import importlib
 import warnings
 
-from typing import Optional
+from types import ModuleType
+from typing import Optional, Dict
+
+
+def _discover_bookkeepings(path: str) -> frozenset:
+    """
+    List the modules in a package folder.
+    Uses the directory entries types, so no stat() is needed for each file.
+    """
+    names = set()
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_file() and name.endswith('.py') and name != '__init__.py':
+                names.add(name[:-3])
+            elif entry.is_dir() and os.path.exists(os.path.join(entry.path, '__init__.py')):
+                names.add(name)
+    return frozenset(names)
 
 
 DEFAULT_BOOKKEEPING = 'file'
-BOOKKEEPINGS = set([modname for _, modname, _ in pkgutil.iter_modules(sys.modules[__name__].__path__)])
+BOOKKEEPINGS = _discover_bookkeepings(__path__[0])
+
+_BOOKKEEPING_MODULE_CACHE: Dict[str, ModuleType] = {}
 
 
 def assert_valid_bookkeeping(bookkeeping_method: Optional[str] = None):
@@ -47,10 +65,12 @@ def daemonize(daemon_name: str, sub_path: Optional[str], bookkeeping_method: Opt
     """
     if bookkeeping_method is None:
         bookkeeping_method = DEFAULT_BOOKKEEPING
-    assert_valid_bookkeeping(bookkeeping_method)
-
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore', category=ImportWarning)
-        bookkeeping_module = importlib.import_module(f'.{bookkeeping_method}', __name__)
+    bookkeeping_module = _BOOKKEEPING_MODULE_CACHE.get(bookkeeping_method)
+    if bookkeeping_module is None:
+        assert_valid_bookkeeping(bookkeeping_method)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=ImportWarning)
+            bookkeeping_module = importlib.import_module(f'.{bookkeeping_method}', __name__)
+        _BOOKKEEPING_MODULE_CACHE[bookkeeping_method] = bookkeeping_module
 
     return bookkeeping_module.daemonize(daemon_name=daemon_name, sub_path=sub_path)
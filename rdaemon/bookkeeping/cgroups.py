@@ -17,9 +17,11 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import atexit
+import functools
 import os
 import signal
 import sys
+import time
 
 from pycgroups import Cgroup
 
@@ -27,6 +29,15 @@ import rdaemon.process as daemon_process
 
 DEFAULT_DAEMON_CGROUP = "rdaemons"
 
+# Mount point of the cgroup file system (the unified hierarchy on cgroup v2)
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# The maximal time (in seconds) to wait for the processes of a killed cgroup to exit before deleting it
+CGROUP_KILL_TIMEOUT = 5
+
+# pidfd_open(2) and pidfd_send_signal(2) are available in Python 3.9+ (Linux 5.3+)
+HAS_PIDFD = hasattr(os, "pidfd_open") and hasattr(signal, "pidfd_send_signal")
+
 
 #########################################################################
 # Module PID file API
@@ -41,7 +52,7 @@ def default_daemon_cgroup_path(daemon_name, sub_path=None):
     """
     if sub_path is None:
         sub_path = ""
-    return os.path.join(DEFAULT_DAEMON_CGROUP, sub_path, daemon_name)
+    return __cached_default_daemon_cgroup_path(daemon_name, sub_path)
 
 
 def daemon_cgroup_path(daemon_name=None, sub_path=None, cgroup_path=None):
@@ -74,8 +85,8 @@ def daemon_cgroup(daemon_name=None, sub_path=None, cgroup_path=None, create=Fals
     cgroup_path = daemon_cgroup_path(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path)
     try:
         return Cgroup(cgroup_path, create=create)
-    except:
-        raise ValueError(f"The daemon is not active. No cgroup: {cgroup_path}.")
+    except OSError:
+        raise ValueError(f"The daemon is not active. No cgroup: {cgroup_path}.") from None
 
 
 #########################################################################
@@ -91,12 +102,7 @@ def get_daemon_pid(daemon_name=None, sub_path=None, cgroup_path=None):
     :return: The PIDs as a list of integers or raise error
     """
     cgroup = daemon_cgroup(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path, create=False)
-    procs = cgroup.procs
-    if len(procs) == 0:
-        cgroup.delete(recursive=True)
-        raise ValueError(f"The daemon is not active. Cgroup path have no tasks: {cgroup.path}.")
-
-    return procs
+    return __cgroup_procs(cgroup)
 
 
 def kill_daemon(daemon_name=None, sub_path=None, cgroup_path=None, sig=signal.SIGTERM):
@@ -109,14 +115,20 @@ def kill_daemon(daemon_name=None, sub_path=None, cgroup_path=None, sig=signal.SI
     :return: True if successful
     """
     try:
-        pids = get_daemon_pid(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path)
-    except:
+        cgroup_path = daemon_cgroup_path(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path)
+        cgroup = daemon_cgroup(cgroup_path=cgroup_path, create=False)
+        # On cgroup v2, SIGKILL the entire cgroup at once without reading its procs
+        is_cgroup_killed = sig == signal.SIGKILL and __cgroup_kill(cgroup_path)
+        pids = None if is_cgroup_killed else __cgroup_procs(cgroup)
+    except (OSError, ValueError):
         return
 
-    daemon_process.kill_multiple_process(pids, sig=sig)
+    if is_cgroup_killed:
+        # The cgroup can only be deleted once all the killed processes exited
+        __wait_cgroup_empty(cgroup_path)
+    else:
+        __signal_procs(pids, sig)
     if sig == signal.SIGKILL:
-        cgroup = daemon_cgroup(daemon_name=daemon_name, sub_path=sub_path,
-                               cgroup_path=cgroup_path, create=False)
         cgroup.delete(recursive=True)
     return True
 
@@ -130,11 +142,24 @@ def is_daemon_running(daemon_name=None, sub_path=None, cgroup_path=None):
     :return: True if it is running
     """
     try:
-        pids = get_daemon_pid(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path)
-    except:
+        cgroup_path = daemon_cgroup_path(daemon_name=daemon_name, sub_path=sub_path, cgroup_path=cgroup_path)
+        pids_count = __pids_current(cgroup_path)
+        if pids_count is not None:
+            return pids_count > 0
+        cgroup = daemon_cgroup(cgroup_path=cgroup_path, create=False)
+        return len(cgroup.procs) > 0
+    except (OSError, ValueError):
         return False
 
-    return len(pids) > 0
+
+def running_daemons(daemon_names, sub_path=None):
+    """
+    Check which of the daemons are running
+    :param daemon_names: An iterable of daemon names
+    :param sub_path:
+    :return: A set of the names of the running daemons
+    """
+    return {d for d in daemon_names if is_daemon_running(daemon_name=d, sub_path=sub_path)}
 
 
 def kill_all_daemons(sub_path=None, cgroup_path=DEFAULT_DAEMON_CGROUP, sig=signal.SIGTERM):
@@ -147,10 +172,18 @@ def kill_all_daemons(sub_path=None, cgroup_path=DEFAULT_DAEMON_CGROUP, sig=signa
     """
     if sub_path is None:
         sub_path = ""
+
+    # On cgroup v2, SIGKILL the entire hierarchy at once without walking its procs
+    if sig == signal.SIGKILL and __cgroup_kill(os.path.join(cgroup_path, sub_path)):
+        # The hierarchy can only be deleted once all the killed processes exited
+        __wait_cgroup_empty(os.path.join(cgroup_path, sub_path))
+        Cgroup(cgroup_path, sub_path, create=False).delete(recursive=True)
+        return
+
     cgroup = Cgroup(cgroup_path, sub_path, create=False)
 
     pids = cgroup.hierarchy_procs()
-    daemon_process.kill_multiple_process(pids, sig=sig)
+    __signal_procs(pids, sig)
 
     if sig == signal.SIGKILL:
         cgroup.delete(recursive=True)
@@ -167,7 +200,7 @@ def clear_empty_sub_path(sub_path=None, cgroup_path=DEFAULT_DAEMON_CGROUP):
         cgroup = daemon_cgroup(daemon_name="", sub_path=sub_path, cgroup_path=cgroup_path,
                                create=False)
         cgroup.delete()
-    except:
+    except (OSError, ValueError):
         pass
 
 
@@ -188,19 +221,159 @@ def daemonize(daemon_name=None, sub_path=None, cgroup_path=None):
 
     daemon_process.convert_to_daemon()
 
-    atexit.register(__del_cgroup, cgroup.path)
+    atexit.register(__del_cgroup, cgroup)
 
 
 #########################################################################
 # Module helper functions
 #########################################################################
 
-def __del_cgroup(cgroup_path):
+@functools.lru_cache(maxsize=1024)
+def __cached_default_daemon_cgroup_path(daemon_name, sub_path):
     """
-    Remove the pid file of a daemon
-    :param cgroup_path: The cgroup to remove
+    See default_daemon_cgroup_path(). Cached as it is called on every daemon query.
+    :param daemon_name: The daemon name
+    :param sub_path: A normalized sub path (not None)
+    :return: The daemon cgroup path
+    """
+    # Cgroup paths are always relative and '/'-delimited
+    if not sub_path:
+        return f"{DEFAULT_DAEMON_CGROUP}/{daemon_name}"
+    return f"{DEFAULT_DAEMON_CGROUP}/{sub_path}/{daemon_name}"
+
+
+def __cgroup_procs(cgroup):
+    """
+    Read the PIDs of a daemon cgroup. Removes the cgroup if it is empty.
+    :param cgroup: The daemon cgroup object
+    :return: The PIDs as a list of integers or raise error
+    """
+    # Check the cheap task counter first, so an empty cgroup does not read cgroup.procs
+    if __pids_current(cgroup.path) == 0:
+        procs = []
+    else:
+        procs = cgroup.procs
+
+    if len(procs) == 0:
+        cgroup.delete(recursive=True)
+        raise ValueError(f"The daemon is not active. Cgroup path have no tasks: {cgroup.path}.")
+
+    return procs
+
+
+def __signal_procs(pids, sig):
+    """
+    Send a signal to the processes of a cgroup.
+    cgroup.procs only lists thread group IDs, so each process is signaled directly
+    (through its pidfd when available) without looking up its TGID in /proc.
+    :param pids: The PIDs as listed in cgroup.procs
+    :param sig: The signal to send
     :return: None
     """
+    if not HAS_PIDFD:
+        daemon_process.kill_multiple_process(pids, sig=sig)
+        return
+
+    for pid in pids:
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            continue
+        except OSError:
+            # pidfd is not supported by the kernel
+            daemon_process.kill_process(pid, sig)
+            continue
+
+        try:
+            signal.pidfd_send_signal(pidfd, sig)
+        except OSError:
+            pass
+        finally:
+            os.close(pidfd)
+
+
+def __pids_current(cgroup_path):
+    """
+    Read the number of tasks in the cgroup hierarchy from the pids controller.
+    This is a single integer, so it is much cheaper than reading cgroup.procs.
+    :param cgroup_path: The cgroup path
+    :return: The number of tasks, or None if the pids controller is not available
+    """
+    for pids_file in (os.path.join(CGROUP_ROOT, cgroup_path, "pids.current"),
+                      os.path.join(CGROUP_ROOT, "pids", cgroup_path, "pids.current")):
+        try:
+            fd = os.open(pids_file, os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            continue
+
+        try:
+            return int(os.read(fd, 32))
+        except (OSError, ValueError):
+            return None
+        finally:
+            os.close(fd)
+
+    return None
+
+
+def __cgroup_kill(cgroup_path):
+    """
+    Kill all the processes in the cgroup hierarchy using a single write to cgroup.kill.
+    Only available in cgroup v2 (Linux 5.14+).
+    :param cgroup_path: The cgroup path
+    :return: True if successful, False if not supported
+    """
+    try:
+        fd = os.open(os.path.join(CGROUP_ROOT, cgroup_path, "cgroup.kill"), os.O_WRONLY | os.O_CLOEXEC)
+    except OSError:
+        return False
+
+    try:
+        os.write(fd, b"1")
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def __wait_cgroup_empty(cgroup_path, timeout=CGROUP_KILL_TIMEOUT):
+    """
+    Wait until there are no processes in the cgroup hierarchy (cgroup v2 only)
+    :param cgroup_path: The cgroup path
+    :param timeout: The maximal time to wait in seconds
+    :return: True if the hierarchy is empty, False on timeout (or if its status cannot be read)
+    """
+    events_file = os.path.join(CGROUP_ROOT, cgroup_path, "cgroup.events")
+    end_time = time.monotonic() + timeout
+    while True:
+        try:
+            with open(events_file, "rb") as f:
+                if b"populated 0" in f.read():
+                    return True
+        except OSError:
+            return False
+
+        if time.monotonic() >= end_time:
+            return False
+        time.sleep(0.01)
+
+
+def __del_cgroup(cgroup):
+    """
+    Remove the cgroup of a daemon
+    :param cgroup: The cgroup object to remove
+    :return: None
+    """
+    try:
+        cgroup.clear_and_delete(recursive=True)
+        return
+    except OSError:
+        # The object might have been invalidated (e.g., its descriptors were closed
+        # during daemonization). Reopen it by its path.
+        pass
+
+    cgroup_path = cgroup.path
     try:
         cgroup = Cgroup(cgroup_path, create=False)
     except OSError as e:
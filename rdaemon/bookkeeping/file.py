@@ -17,15 +17,35 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import atexit
+import functools
 import os
+import shlex
 import signal
+import subprocess
 import sys
+import threading
 from argparse import ArgumentParser
+from collections import OrderedDict
 
 import rdaemon.process as daemon_process
 
 DEFAULT_DAEMON_PID_FOLDER = "/tmp/rdaemons"
 
+# Open (read-only) descriptors of PID files, to avoid reopening them on every query.
+# The least recently used descriptors are closed beyond PID_FD_CACHE_SIZE.
+PID_FD_CACHE_SIZE = 128
+_pid_fd_cache = OrderedDict()
+
+# Open descriptors of PID folders, so opening a PID file only resolves its name
+PID_FOLDER_FD_CACHE_SIZE = 16
+_pid_folder_fd_cache = OrderedDict()
+
+# Guards both descriptor caches, as daemons may be queried from multiple threads
+_pid_fd_cache_lock = threading.Lock()
+
+# O_PATH is Linux only
+O_PATH = getattr(os, "O_PATH", os.O_RDONLY)
+
 
 #########################################################################
 # Module PID file API
@@ -40,7 +60,7 @@ def default_daemon_pid_file(daemon_name, sub_path=None):
     """
     if sub_path is None:
         sub_path = ""
-    return os.path.join(DEFAULT_DAEMON_PID_FOLDER, sub_path, f"{daemon_name}.pid")
+    return __cached_default_daemon_pid_file(daemon_name, sub_path)
 
 
 def daemon_pid_file(daemon_name=None, sub_path=None, pid_file=None):
@@ -76,12 +96,11 @@ def get_daemon_pid(daemon_name=None, sub_path=None, pid_file=None):
     pid_file = daemon_pid_file(daemon_name=daemon_name, sub_path=sub_path, pid_file=pid_file)
 
     try:
-        with open(pid_file, "r") as fp:
-            pid_data = fp.read()
-        return int(pid_data)
-    except:
+        # int() parses the raw bytes directly, no text decoding is needed
+        return int(__read_pid_file(pid_file))
+    except (OSError, ValueError):
         raise ValueError(f"The daemon is not active. "
-                         f"No pid file named: f{pid_file}")
+                         f"No pid file named: {pid_file}") from None
 
 
 def kill_daemon(daemon_name=None, sub_path=None, pid_file=None, sig=signal.SIGTERM):
@@ -98,7 +117,7 @@ def kill_daemon(daemon_name=None, sub_path=None, pid_file=None, sig=signal.SIGTE
     try:
         if success and sig == signal.SIGKILL:
             __delpid(pid_file)
-    except:
+    except OSError:
         pass
     return success
 
@@ -115,38 +134,70 @@ def is_daemon_running(daemon_name=None, sub_path=None, pid_file=None):
 
     try:
         pid = get_daemon_pid(pid_file=pid_file)
-    except:
+    except ValueError:
         return False
 
-    exists = daemon_process.pid_exists(pid)
+    exists = daemon_process.proc_pid_exists(pid)
     if not exists:
         __delpid(pid_file)
 
     return exists
 
 
-def kill_all_daemons(sub_path=None, pid_path=DEFAULT_DAEMON_PID_FOLDER, sig=signal.SIGTERM):
+def running_daemons(daemon_names, sub_path=None):
+    """
+    Check which of the daemons are running
+    :param daemon_names: An iterable of daemon names
+    :param sub_path:
+    :return: A set of the names of the running daemons
+    """
+    daemon_pids = {}
+    for daemon_name in daemon_names:
+        try:
+            daemon_pids[daemon_name] = get_daemon_pid(daemon_name=daemon_name, sub_path=sub_path)
+        except ValueError:
+            pass
+
+    live_pids = daemon_process.pids_exist(daemon_pids.values())
+    running = set()
+    for daemon_name, pid in daemon_pids.items():
+        if pid in live_pids:
+            running.add(daemon_name)
+        else:
+            __delpid(default_daemon_pid_file(daemon_name, sub_path))
+    return running
+
+
+def kill_all_daemons(sub_path=None, pid_path=DEFAULT_DAEMON_PID_FOLDER, sig=signal.SIGTERM, exclude=()):
     """
     Kills all the daemons
     :param sub_path: See daemon_pid_file()
     :param pid_path: The folder to lookup pid files
     :param sig: The signal to send
+    :param exclude: Names of daemons to keep running
     :return: None
     """
     if sub_path is None:
         sub_path = ""
     folder = os.path.join(pid_path, sub_path)
     try:
-        pid_path_list = [os.path.join(folder, f) for f in os.listdir(folder)]
-    except:
+        folder_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    except OSError:
         return
 
-    for pid_file_path in pid_path_list:
-        if os.path.isfile(pid_file_path):
-            try:
-                kill_daemon(pid_file=pid_file_path, sig=sig)
-            except:
-                pass
+    # Read all the PIDs first, then signal them in a tight loop
+    try:
+        daemon_pids = __read_folder_pid_files(folder_fd)
+    finally:
+        os.close(folder_fd)
+
+    excluded_pid_file_names = {f"{daemon_name}.pid" for daemon_name in exclude}
+    for pid_file_name, pid in daemon_pids:
+        if pid_file_name in excluded_pid_file_names:
+            continue
+        success = daemon_process.kill_process(pid, sig)
+        if success and sig == signal.SIGKILL:
+            __delpid(os.path.join(folder, pid_file_name))
 
 
 def clear_empty_sub_path(sub_path=None, pid_path=DEFAULT_DAEMON_PID_FOLDER):
@@ -161,7 +212,7 @@ def clear_empty_sub_path(sub_path=None, pid_path=DEFAULT_DAEMON_PID_FOLDER):
     folder = os.path.join(pid_path, sub_path)
     try:
         os.removedirs(folder)
-    except:
+    except OSError:
         pass
 
 
@@ -175,6 +226,10 @@ def daemonize(daemon_name=None, sub_path=None, pid_file=None):
     :return: None. Will exit if fail.
     """
     pid_file = daemon_pid_file(daemon_name=daemon_name, sub_path=sub_path, pid_file=pid_file)
+    # All the descriptors are closed during daemonization
+    with _pid_fd_cache_lock:
+        _pid_fd_cache.clear()
+        _pid_folder_fd_cache.clear()
     daemon_process.convert_to_daemon()
 
     __write_daemon_pid_file(pid_file)
@@ -192,31 +247,194 @@ def __write_daemon_pid_file(pid_file):
     :param pid_file: The file to write the PID to
     :return: None. Will exit if fail.
     """
-    pid_file_folder = os.path.dirname(pid_file)
-    if not os.path.isdir(pid_file_folder):
-        os.makedirs(pid_file_folder)
-
     pid = str(os.getpid())
+    tmp_pid_file = pid_file + ".tmp"
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
     try:
-        with open(pid_file, "w+") as f:
-            f.write("%s\n" % pid)
+        try:
+            fd = os.open(tmp_pid_file, flags, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(pid_file), exist_ok=True)
+            fd = os.open(tmp_pid_file, flags, 0o644)
+        try:
+            os.write(fd, b"%s\n" % pid.encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp_pid_file, pid_file)
     except EnvironmentError as e:
         print("Daemon failed to write PID file: %d (%s)" % (e.errno, e.strerror), file=sys.stderr)
         sys.exit(1)
 
 
+@functools.lru_cache(maxsize=1024)
+def __cached_default_daemon_pid_file(daemon_name, sub_path):
+    """
+    See default_daemon_pid_file(). Cached as it is called on every daemon query.
+    :param daemon_name: The daemon name
+    :param sub_path: A normalized sub path (not None)
+    :return: The default daemon PID file
+    """
+    return os.path.join(DEFAULT_DAEMON_PID_FOLDER, sub_path, f"{daemon_name}.pid")
+
+
+def __read_pid_file(pid_file):
+    """
+    Read the content of a PID file using a cached descriptor
+    :param pid_file: The PID file
+    :return: The file content (bytes)
+    """
+    # The descriptor is used while holding the lock, so it cannot be closed (and its number reused) meanwhile
+    with _pid_fd_cache_lock:
+        fd = _pid_fd_cache.get(pid_file)
+        if fd is not None:
+            try:
+                # A removed/replaced PID file will have no links
+                if os.fstat(fd).st_nlink > 0:
+                    _pid_fd_cache.move_to_end(pid_file)
+                    return os.pread(fd, 32, 0)
+            except OSError:
+                pass
+            __close_cached_fd(_pid_fd_cache, pid_file)
+
+        fd = __open_pid_file(pid_file)
+        __cache_fd(_pid_fd_cache, pid_file, fd, PID_FD_CACHE_SIZE)
+        return os.pread(fd, 32, 0)
+
+
+def __open_pid_file(pid_file):
+    """
+    Open a PID file for reading relative to a cached descriptor of its folder.
+    Must be called while holding the descriptor caches lock.
+    :param pid_file: The PID file
+    :return: A file descriptor
+    """
+    folder, pid_file_name = os.path.split(pid_file)
+    folder_fd = _pid_folder_fd_cache.get(folder)
+    if folder_fd is not None:
+        try:
+            # A removed folder will have no links
+            is_valid = os.fstat(folder_fd).st_nlink > 0
+        except OSError:
+            is_valid = False
+        if is_valid:
+            _pid_folder_fd_cache.move_to_end(folder)
+        else:
+            __close_cached_fd(_pid_folder_fd_cache, folder)
+            folder_fd = None
+
+    if folder_fd is None:
+        folder_fd = os.open(folder or os.curdir, O_PATH | os.O_DIRECTORY | os.O_CLOEXEC)
+        __cache_fd(_pid_folder_fd_cache, folder, folder_fd, PID_FOLDER_FD_CACHE_SIZE)
+
+    return os.open(pid_file_name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=folder_fd)
+
+
+def __read_folder_pid_files(folder_fd):
+    """
+    Read all the PID files in a folder.
+    Files are opened relative to the folder descriptor, so the folder path is resolved only once.
+    :param folder_fd: A descriptor of the folder
+    :return: A list of tuples: (PID file name, PID)
+    """
+    # The entries' types come from the directory listing, so no stat() is needed per entry
+    with os.scandir(folder_fd) as it:
+        pid_file_names = [entry.name for entry in it if entry.is_file() and not entry.name.endswith(".tmp")]
+
+    daemon_pids = []
+    for pid_file_name in pid_file_names:
+        try:
+            fd = os.open(pid_file_name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=folder_fd)
+        except OSError:
+            continue
+
+        try:
+            daemon_pids.append((pid_file_name, int(os.read(fd, 32))))
+        except (OSError, ValueError):
+            pass
+        finally:
+            os.close(fd)
+
+    return daemon_pids
+
+
+def __close_pid_fd(pid_file):
+    """
+    Close the cached descriptor of a PID file (if any)
+    :param pid_file: The PID file
+    :return: None
+    """
+    with _pid_fd_cache_lock:
+        __close_cached_fd(_pid_fd_cache, pid_file)
+
+
+def __cache_fd(cache, key, fd, max_size):
+    """
+    Add a descriptor to a cache, and close the least recently used descriptors beyond its size.
+    Must be called while holding the descriptor caches lock.
+    :param cache: The descriptors cache (OrderedDict)
+    :param key: The path of the descriptor
+    :param fd: The descriptor
+    :param max_size: The maximal number of descriptors in the cache
+    :return: None
+    """
+    cache[key] = fd
+    while len(cache) > max_size:
+        __close_cached_fd(cache, next(iter(cache)))
+
+
+def __close_cached_fd(cache, key):
+    """
+    Remove a descriptor from a cache and close it (if any).
+    Must be called while holding the descriptor caches lock.
+    :param cache: The descriptors cache
+    :param key: The path of the descriptor
+    :return: None
+    """
+    fd = cache.pop(key, None)
+    if fd is not None:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
 def __delpid(pid_file):
     """
     Remove the pid file of a daemon
     :param pid_file: The pid file to remove
     :return: None
     """
+    __close_pid_fd(pid_file)
     try:
         os.remove(pid_file)
     except OSError as e:
         print("Unable to remove PID file %s: %d (%s)" % (pid_file, e.errno, e.strerror), file=sys.stderr)
 
 
+def __spawn_command(command, output_file, pid_file):
+    """
+    Run a command in the background (in a new session) without a shell.
+    :param command: The command line to execute
+    :param output_file: The file to redirect the command's stdout and stderr to
+    :param pid_file: The file to write the command's PID to
+    :return: None
+    """
+    output_fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+    try:
+        process = subprocess.Popen(shlex.split(command), stdin=subprocess.DEVNULL,
+                                   stdout=output_fd, stderr=output_fd,
+                                   close_fds=True, start_new_session=True)
+    finally:
+        os.close(output_fd)
+
+    fd = os.open(pid_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+    try:
+        os.write(fd, b"%d\n" % process.pid)
+    finally:
+        os.close(fd)
+
+
 ###########################################################################
 # Main
 ###########################################################################
@@ -227,7 +445,6 @@ def main():
                   output_file="/tmp/%(daemon_local_name)s.out",
                   daemon_name="%(daemon_local_name)s"
                   )
-    execute_cmd = "%(execute)s &> %(output_file)s & echo $! > %(pid_file)s"
 
     parser = ArgumentParser(description=description)
     parser.add_argument("daemon_local_name", metavar="DAEMON-NAME")
@@ -255,30 +472,30 @@ def main():
     daemon_name = params['daemon_name']
 
     if args.execute is not None:
-        if is_daemon_running(daemon_name, pid_file):
+        if is_daemon_running(daemon_name, pid_file=pid_file):
             print("Backend server with this name is already running: %(daemon_name)s" % params)
             exit(1)
 
         try:
             os.remove(pid_file)
-        except:
+        except OSError:
             pass
 
         try:
             os.remove(output_file)
-        except:
+        except OSError:
             pass
 
-        os.subprocess.run(execute_cmd % params, shell=True)
+        __spawn_command(args.execute, output_file, pid_file)
 
     if args.get_output is True:
         print(output_file)
 
     if args.kill is True:
-        kill_daemon(daemon_name, pid_file)
+        kill_daemon(daemon_name, pid_file=pid_file)
 
     if args.is_running is True:
-        print(is_daemon_running(daemon_name, pid_file))
+        print(is_daemon_running(daemon_name, pid_file=pid_file))
 
 
 if __name__ == "__main__":
@@ -17,15 +17,95 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import atexit
+import inspect
+import math
 import multiprocessing
+import os
 import threading
-from time import time, sleep
+import weakref
+from time import monotonic, sleep
 
 from rdaemon.interfaces import IDaemon, IPeriodicTask
 from rdaemon.logging import LoggedEntity
 from zope.interface.declarations import implementer
 from zope.interface.verify import verifyObject
 
+# Interface verification is skipped with "python -O" or if RDAEMON_SKIP_VERIFY is set
+VERIFY_INTERFACES = __debug__ and not os.environ.get("RDAEMON_SKIP_VERIFY")
+
+# The (interface, class) pairs that were already verified
+_VERIFIED = set()
+
+# Daemons that should be terminated on exit. Weak references allow collected daemons to drop out.
+_LIVE_DAEMONS = weakref.WeakSet()
+
+# The daemon wrapper class of each wrapped class (see wrap_as_daemon())
+_WRAPPER_CACHE = {}
+
+
+def verify_object(interface, obj):
+    """
+    Verify that an object provides an interface. Each class is verified only once.
+    :param interface: The interface
+    :param obj: The object to verify
+    :return: None. Raise an exception if the object is invalid.
+    """
+    if not VERIFY_INTERFACES:
+        return
+
+    key = (interface, type(obj))
+    if key in _VERIFIED:
+        return
+
+    verifyObject(interface, obj, tentative=True)
+    _VERIFIED.add(key)
+
+
+def next_period_wakeup(wakeup, period, now):
+    """
+    Advance a wakeup on a fixed schedule, to avoid accumulating drift.
+    Periods that were already missed (e.g., due to a long task) are skipped rather than run back to back.
+    :param wakeup: The last wakeup (monotonic clock)
+    :param period: The period in seconds
+    :param now: The current time (monotonic clock)
+    :return: The first wakeup on the schedule that is after both the last wakeup and the current time
+    """
+    return wakeup + period * max(1, math.floor((now - wakeup) / period) + 1)
+
+
+def has_finished_attribute(task):
+    """
+    :param task: An IPeriodicTask object
+    :return: True if the task exposes its status as a "finished" attribute (see IPeriodicTask.is_finished())
+    """
+    return isinstance(getattr(type(task), "finished", None), bool)
+
+
+def _register_live_daemon(daemon):
+    """
+    Register a daemon to be terminated on exit
+    :param daemon: The daemon object
+    :return: None
+    """
+    try:
+        _LIVE_DAEMONS.add(daemon)
+    except TypeError:
+        # Not hashable or not weak-referencable (e.g., a wrapped object)
+        atexit.register(daemon.terminate)
+
+
+@atexit.register
+def _terminate_live_daemons():
+    """
+    Assert that all the live daemons are terminated on exit
+    :return: None
+    """
+    for daemon in list(_LIVE_DAEMONS):
+        try:
+            daemon.terminate()
+        except Exception:
+            pass
+
 
 @implementer(IDaemon)
 class DaemonThread(threading.Thread):
@@ -34,14 +114,30 @@ class DaemonThread(threading.Thread):
     """
 
     def __init__(self, daemon_object):
-        verifyObject(IDaemon, daemon_object, tentative=True)
+        verify_object(IDaemon, daemon_object)
         threading.Thread.__init__(self,
                                   name=daemon_object.__class__.__name__,
                                   daemon=True)
         self.daemon_object = daemon_object
+        self.__bind_daemon_methods()
 
         # Assert that the daemon is terminated on exit
-        atexit.register(self.terminate)
+        _register_live_daemon(self)
+
+    def __bind_daemon_methods(self):
+        """
+        Bind the daemon's public methods to this object once, so calling them
+        does not go through __getattr__ on every access.
+        Only applicable for methods that are not already taken by Thread object.
+        :return: None
+        """
+        daemon_class = type(self.daemon_object)
+        for name in dir(daemon_class):
+            if name.startswith('_') or hasattr(type(self), name):
+                continue
+            attr = inspect.getattr_static(daemon_class, name)
+            if callable(attr) or isinstance(attr, (staticmethod, classmethod)):
+                setattr(self, name, getattr(self.daemon_object, name))
 
     def run(self):
         """ IDaemon interface function """
@@ -63,6 +159,7 @@ class DaemonThread(threading.Thread):
         """
         Extent the thread object to have the same functionality as the daemon.
         Only applicable for attributes that are not already taken by Thread object.
+        Public methods are already bound in __init__, so this is only used for the rest.
         :param item: The attribute name
         :return: This attribute from the daemon object
         """
@@ -82,7 +179,7 @@ class BaseDaemon(LoggedEntity):
         self._event = DaemonEvent()
 
         # Assert that the daemon is terminated on exit
-        atexit.register(self.terminate)
+        _register_live_daemon(self)
 
     def __del__(self):
         """
@@ -126,9 +223,13 @@ def wrap_as_daemon(obj, daemon_name=None):
     :param daemon_name: The daemon name
     :return: None
     """
-    class_name = f"{obj.__class__.__name__}DaemonWrapper"
-    new_class = type(class_name, (BaseDaemon, obj.__class__), {})
-    implementer(IDaemon)(new_class)
+    obj_class = obj.__class__
+    new_class = _WRAPPER_CACHE.get(obj_class)
+    if new_class is None:
+        class_name = f"{obj_class.__name__}DaemonWrapper"
+        new_class = type(class_name, (BaseDaemon, obj_class), {})
+        implementer(IDaemon)(new_class)
+        _WRAPPER_CACHE[obj_class] = new_class
     obj.__class__ = new_class
     BaseDaemon.__init__(obj, name=daemon_name)
 
@@ -140,20 +241,25 @@ class PeriodicDaemon(BaseDaemon):
      - Run a periodic task on a periodic interval.
     """
 
+    # Invalid wakeup periods that were already reported
+    _warned_periods = set()
+
     def __init__(self, task, wakeup_period, name=None):
-        verifyObject(IPeriodicTask, task, tentative=True)
+        verify_object(IPeriodicTask, task)
         if name is None:
             name = task.__class__.__name__
         BaseDaemon.__init__(self, name=name)
 
         self.task = task
+        self._read_finished = has_finished_attribute(task)
 
-        if wakeup_period < 1:
+        if wakeup_period < 1 and wakeup_period not in PeriodicDaemon._warned_periods:
+            PeriodicDaemon._warned_periods.add(wakeup_period)
             self.log_warning("Wake interval must be at least 1 second."
                              "Was: %s and reset to 1 second.", wakeup_period)
-            wakeup_period = 1
 
-        self.wakeup_period = wakeup_period
+        self.wakeup_period = max(1, wakeup_period)
+        self._period_f = float(self.wakeup_period)
 
     ###########################################################################
     # IDaemon interface
@@ -169,13 +275,17 @@ class PeriodicDaemon(BaseDaemon):
         self.log_info("Staring %s periodic loop", self)
 
         try:
-            last_wakeup = time()
+            next_wakeup = monotonic() + self._period_f
             self._event.reset()
 
             while not self.is_terminated() and self.__is_finished() is False:
-                is_scheduled_wakeup = self.wait_for_next_period(last_wakeup)
-                last_wakeup = time()
+                is_scheduled_wakeup = self.wait_for_next_period(next_wakeup)
+                if not is_scheduled_wakeup:
+                    next_wakeup = monotonic() + self._period_f
                 self.__periodic_task(is_scheduled_wakeup)
+                if is_scheduled_wakeup:
+                    # Checked after the task, so a task that overruns its period does not run again immediately
+                    next_wakeup = next_period_wakeup(next_wakeup, self._period_f, monotonic())
         except Exception as e:
             self.log_exception("Exception occur during %s: %s", self, e)
         finally:
@@ -188,21 +298,22 @@ class PeriodicDaemon(BaseDaemon):
     # Internal private functions (should not be overridden by child)
     ###########################################################################
 
-    def calc_next_wait_time(self, last_wakeup):
+    @staticmethod
+    def calc_next_wait_time(next_wakeup):
         """
-        :param last_wakeup: The last wakeup timestamp
+        :param next_wakeup: The next wakeup timestamp (monotonic clock)
         :return: How long to sleep until the next period
         """
-        return max(0, self.wakeup_period - (time() - last_wakeup))
+        return max(0, next_wakeup - monotonic())
 
-    def wait_for_next_period(self, last_wakeup):
+    def wait_for_next_period(self, next_wakeup):
         """
         Waits until the next period
-        :param last_wakeup: The last wakeup timestamp
+        :param next_wakeup: The next wakeup timestamp (monotonic clock)
         :return: True if waked up on time,
                  False if waked up due to an interrupt
         """
-        wait_time = self.calc_next_wait_time(last_wakeup)
+        wait_time = self.calc_next_wait_time(next_wakeup)
         return not self._event.wait_and_clear(wait_time)
 
     ###########################################################################
@@ -212,6 +323,9 @@ class PeriodicDaemon(BaseDaemon):
     def __setup(self):
         """ See IPeriodicTask """
         try:
+            # Tasks may wake up the daemon when they finish, instead of waiting for the next period
+            if hasattr(self.task, "set_wakeup_func"):
+                self.task.set_wakeup_func(self.notify)
             self.task.setup()
             return True
         except Exception as e:
@@ -234,6 +348,8 @@ class PeriodicDaemon(BaseDaemon):
 
     def __is_finished(self):
         """ See IPeriodicTask """
+        if self._read_finished:
+            return self.task.finished
         try:
             return self.task.is_finished()
         except Exception as e:
@@ -307,6 +423,8 @@ class TestSleeperDaemon(BaseDaemon):
 ###########################################################################
 
 class ThreadingValue:
+    __slots__ = ("value",)
+
     def __init__(self, init_val):
         self.value = init_val
 
@@ -315,16 +433,27 @@ class DaemonEvent:
     """
     A re-implementation of python's threading.Event to support termination
     """
+    __slots__ = ("__cond", "__flag", "__terminated")
 
-    def __init__(self):
-        try:
-            self.__cond = multiprocessing.Condition()
-            self.__flag = multiprocessing.Value("b", False)
-            self.__terminated = multiprocessing.Value("b", False)
-        except:
-            self.__cond = threading.Condition()
-            self.__flag = ThreadingValue(False)
-            self.__terminated = ThreadingValue(False)
+    def __init__(self, cross_process=False):
+        """
+        :param cross_process: If True, use multiprocessing primitives so the event can be shared
+            between processes. Otherwise (default), use the lighter threading primitives.
+        """
+        if cross_process:
+            try:
+                # All the writes are guarded by the condition, so the values do not need
+                # their own lock. This keeps is_set() and is_terminated() lock-free.
+                self.__cond = multiprocessing.Condition()
+                self.__flag = multiprocessing.Value("b", False, lock=False)
+                self.__terminated = multiprocessing.Value("b", False, lock=False)
+                return
+            except (ImportError, OSError):
+                pass
+
+        self.__cond = threading.Condition()
+        self.__flag = ThreadingValue(False)
+        self.__terminated = ThreadingValue(False)
 
     def _reset_internal_locks(self):
         # private!  called by Thread._reset_internal_locks by _after_fork()
@@ -381,17 +510,18 @@ class DaemonEvent:
         :param timeout: Wake up after this timeout
         :return: Previous flag value
         """
-        self.__cond.acquire()
-        try:
-            if self.is_terminated():
+        cond = self.__cond
+        flag = self.__flag
+        with cond:
+            if self.__terminated.value:
                 return False
-            if not bool(self.__flag.value):
-                self.__cond.wait(timeout)
-            ret_flag = bool(self.__flag.value)
-            self.__flag.value = False
+            ret_flag = bool(flag.value)
+            if not ret_flag:
+                cond.wait(timeout)
+                ret_flag = bool(flag.value)
+            if ret_flag:
+                flag.value = False
             return ret_flag
-        finally:
-            self.__cond.release()
 
     def terminate(self):
         """
@@ -30,12 +30,13 @@ class FlaskAppDaemon(BaseDaemon):
     Flask app daemon
     """
 
-    def __init__(self, app, host, port, debug=False, **options):
+    def __init__(self, app, host, port, debug=False, threads=8, **options):
         super().__init__()
         self.app = app
         self.host = host
         self.port = port
         self.debug = debug
+        self.threads = threads
         self.options = options
         self.options["use_reloader"] = False
 
@@ -50,7 +51,27 @@ class FlaskAppDaemon(BaseDaemon):
 
     def app_run(self):
         """
-        Starts the app. We use this option although it is not recommended.
+        Starts the app using waitress (a multi-threaded WSGI server) if it is installed.
+        Otherwise, or in debug mode, use flask's built-in server.
+        The extra options are only passed to flask's built-in server.
+        """
+        if not self.debug:
+            try:
+                from waitress import serve
+            except ImportError:
+                pass
+            else:
+                ignored_options = sorted(k for k in self.options if k != "use_reloader")
+                if ignored_options:
+                    self.log_warning("Flask server options are not supported by waitress and are ignored: %s",
+                                     ignored_options)
+                return serve(self.app, host=self.host, port=self.port, threads=self.threads)
+
+        return self.app_run_builtin()
+
+    def app_run_builtin(self):
+        """
+        Starts the app using flask's built-in server. It is not recommended for production.
         See flask deployment options for more information:
            http://flask.pocoo.org/docs/0.12/deploying/
         "While lightweight and easy to use, Flask’s built-in server is not suitable for production as
@@ -78,6 +78,8 @@ class IPeriodicTask(Interface):
 
     def is_finished():
         """
-        Ask the task if it is finished
+        Ask the task if it is finished.
+        A task may also define a class-level boolean "finished" attribute,
+        which is then read directly instead of calling this method.
         :return: True if finished
         """
@@ -23,6 +23,9 @@ import sys
 from rdaemon.bookkeeping import daemonize, assert_valid_bookkeeping
 from rdaemon.logging import LogManager, StreamToLogger
 
+# Spawn a fresh interpreter for each daemon, so it has nothing in common with the caller
+SPAWN_CONTEXT = multiprocessing.get_context('spawn')
+
 
 def launch_daemon(name, target, args=(), kwargs=None, daemon_group=None, launcher_timeout=60,
                   log_conf=None, daemon_bookkeeping=None):
@@ -44,11 +47,10 @@ def launch_daemon(name, target, args=(), kwargs=None, daemon_group=None, launche
     if kwargs is None:
         kwargs = {}
 
-    ctx = multiprocessing.get_context('spawn')
-    process = ctx.Process(name="daemon-launcher-%s" % name,
-                          target=_run_daemon_,
-                          args=(name, target, args, kwargs, daemon_group,
-                                log_conf, daemon_bookkeeping))
+    process = SPAWN_CONTEXT.Process(name="daemon-launcher-%s" % name,
+                                    target=_run_daemon_,
+                                    args=(name, target, args, kwargs, daemon_group,
+                                          log_conf, daemon_bookkeeping))
 
     process.start()
     process.join(timeout=launcher_timeout)
@@ -19,9 +19,13 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import os
+import time
+import atexit
+import queue
 import logging
 import logging.handlers
 from threading import RLock
+from types import MappingProxyType
 from typing import IO
 
 
@@ -31,6 +35,9 @@ class LoggedEntity(object):
     Is creates a logger for the child class with the name of the class and a specialized name.
     """
 
+    # Loggers by name, shared by all the entities (avoids the logging module's global lock)
+    _logger_cache = {}
+
     def __init__(self, name=None):
         """
         :param name: The name of the logger. If is None, then only the class name will be used
@@ -46,7 +53,8 @@ class LoggedEntity(object):
         return self.__logger__.info(msg, *args, **kwargs)
 
     def log_debug(self, msg, *args, **kwargs):
-        return self.__logger__.debug(msg, *args, **kwargs)
+        if self.__logger__.isEnabledFor(logging.DEBUG):
+            return self.__logger__.debug(msg, *args, **kwargs)
 
     def log_warning(self, msg, *args, **kwargs):
         return self.__logger__.warning(msg, *args, **kwargs)
@@ -81,16 +89,44 @@ class LoggedEntity(object):
 
         # To allow diamond inheritance, we first check if the logger attribute
         # as already been set. If so, we don't need to initialize the logger.
-        if hasattr(self, "__logger__"):
+        # Look in the instance dict directly, so __getattr__ of child classes is not invoked.
+        if "__logger__" in self.__dict__:
             return
 
         self.__entity_name__ = name
         if name is not None:
-            self.__log_name__ = "%s-%s" % (self.__class__.__name__, name)
+            log_name = "%s-%s" % (self.__class__.__name__, name)
         else:
-            self.__log_name__ = self.__class__.__name__
+            log_name = self.__class__.__name__
+        self.__log_name__ = log_name
+
+        logger = LoggedEntity._logger_cache.get(log_name)
+        if logger is None:
+            logger = LoggedEntity._logger_cache.setdefault(log_name, logging.getLogger(log_name))
+        self.__logger__ = logger
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """
+    A formatter that formats the default time string (asctime) only once per second.
+    The milliseconds are appended to the cached string for each record.
+    """
+
+    def __init__(self, *args, **kwargs):
+        logging.Formatter.__init__(self, *args, **kwargs)
+        self._time_cache = (None, None)
 
-        self.__logger__ = logging.getLogger(self.__log_name__)
+    def formatTime(self, record, datefmt=None):
+        if datefmt is not None:
+            return logging.Formatter.formatTime(self, record, datefmt)
+
+        second = int(record.created)
+        cached_second, time_str = self._time_cache
+        if cached_second != second:
+            time_str = time.strftime(self.default_time_format, self.converter(record.created))
+            self._time_cache = (second, time_str)
+
+        return self.default_msec_format % (time_str, record.msecs)
 
 
 class LogManager:
@@ -114,17 +150,20 @@ class LogManager:
     """
     lock = RLock()
     logging_handlers = []
+    logging_listeners = []
     data_level_initiated = False
 
     FMT = "%(created)f - %(asctime)s - %(processName)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s"
 
-    verbosity_translator = {
-        'debug': logging.DEBUG,
-        'info': logging.INFO,
-        'warn': logging.WARN,
-        'error': logging.ERROR,
-        'critical': logging.CRITICAL,
-    }
+    verbosity_translator = MappingProxyType({
+        key: level
+        for name, level in (('debug', logging.DEBUG),
+                            ('info', logging.INFO),
+                            ('warn', logging.WARN),
+                            ('error', logging.ERROR),
+                            ('critical', logging.CRITICAL))
+        for key in (name, name.upper(), name.title())
+    })
 
     @classmethod
     def init_logger(cls, name, verbosity='debug', output_path="/tmp", max_bytes=0, backups_count=0):
@@ -147,7 +186,8 @@ class LogManager:
     @classmethod
     def stop_logging(cls):
         """
-        Stop logging for specific handler
+        Stop logging for specific handler.
+        Stops the listeners after removing the handlers, so all the queued records are written.
         :return: None
         """
         with cls.lock:
@@ -155,9 +195,37 @@ class LogManager:
                 handler = cls.logging_handlers.pop()
                 try:
                     logging.getLogger().removeHandler(handler)
+                    handler.close()
                 except Exception as e:
                     logging.log(logging.DEBUG, "Failed to remove logging handler %s: %e", handler, e)
 
+            while cls.logging_listeners:
+                listener = cls.logging_listeners.pop()
+                try:
+                    listener.stop()
+                    for handler in listener.handlers:
+                        handler.close()
+                except Exception as e:
+                    logging.log(logging.DEBUG, "Failed to stop logging listener %s: %e", listener, e)
+
+    @classmethod
+    def _after_fork_in_child(cls):
+        """
+        The listeners' threads do not survive fork(), so nothing would write the queued records.
+        Instead, the forked process writes its records directly to the listeners' handlers.
+        :return: None
+        """
+        # The lock might have been held by another thread during the fork
+        cls.lock = RLock()
+        logger = logging.getLogger()
+        for handler in cls.logging_handlers:
+            logger.removeHandler(handler)
+
+        cls.logging_handlers = [handler for listener in cls.logging_listeners for handler in listener.handlers]
+        cls.logging_listeners = []
+        for handler in cls.logging_handlers:
+            logger.addHandler(handler)
+
     ###########################################################
     # Helper functions
     ###########################################################
@@ -172,6 +240,11 @@ class LogManager:
         if isinstance(verbosity, int):
             return verbosity
 
+        if isinstance(verbosity, str):
+            level = cls.verbosity_translator.get(verbosity)
+            if level is not None:
+                return level
+
         try:
             return int(verbosity)
         except ValueError:
@@ -180,8 +253,8 @@ class LogManager:
         if not isinstance(verbosity, str):
             raise ValueError("Verbosity level must be an integer or a string")
 
-        verbosity = verbosity.lower()
-        return cls.verbosity_translator.get(verbosity, 0)
+        level = logging.getLevelName(verbosity.upper())
+        return level if isinstance(level, int) else 0
 
     @classmethod
     def __init_logger_handler(cls, name, verbosity='debug', output_path="/tmp", max_bytes=0, backups_count=0):
@@ -206,15 +279,29 @@ class LogManager:
             if cls.logging_handlers:
                 return
             log_file = os.path.join(output_path, f"{name}.log")
-            handler = logging.handlers.RotatingFileHandler(
+            file_handler = logging.handlers.RotatingFileHandler(
                 log_file, 'a', max_bytes, backups_count)
+            file_handler.setLevel(verbosity)
+            file_handler.setFormatter(CachedTimeFormatter(cls.FMT))
 
+            # The logging threads only enqueue the records.
+            # The formatting, writing and rollover are done by the listener's thread.
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+            listener.start()
+            cls.logging_listeners.append(listener)
+
+            handler = logging.handlers.QueueHandler(log_queue)
             handler.setLevel(verbosity)
-            handler.setFormatter(logging.Formatter(cls.FMT))
             logger.addHandler(handler)
             cls.logging_handlers.append(handler)
 
 
+# Write all the queued records before exit
+atexit.register(LogManager.stop_logging)
+os.register_at_fork(after_in_child=LogManager._after_fork_in_child)
+
+
 class StreamToLogger(IO):
     """
     Taken from:
@@ -233,27 +320,47 @@ class StreamToLogger(IO):
 
     def write(self, buf):
         """
-        Append the buffer to the buffer list
-        and attempt to flush a full line
+        Log each full line in the buffer.
+        A trailing "half" line is saved for later.
+        Only the new buffer is scanned, so a write does not rescan the pending data.
         :param buf: The buffer to write
         :return: None
         """
-        self.buffer_list.append(buf)
-        self.flush()
+        end = buf.find("\n")
+        if end < 0:
+            # No full line yet (e.g., print() writes the message and the line break separately)
+            self.buffer_list.append(buf)
+            return len(buf)
+
+        start = 0
+        while end >= 0:
+            self.buffer_list.append(buf[start:end])
+            self.__log_line("".join(self.buffer_list))
+            self.buffer_list.clear()
+            start = end + 1
+            end = buf.find("\n", start)
+
+        if start < len(buf):
+            self.buffer_list.append(buf[start:])
         return len(buf)
 
     def flush(self):
         """
-        Will flush the buffer line by line.
+        Full lines are logged on write.
         Will not flush "half" lines. Will save for later
         :return: None
         """
-        lines = "".join(self.buffer_list).lstrip().split("\n")
-        self.buffer_list = lines[-1:]
-        lines = lines[:-1]
+        pass
 
-        for line in lines:
-            self.logger.log(self.log_level, line.rstrip().lstrip())
+    def __log_line(self, line):
+        """
+        Log a single line (without its line break). Blank lines are ignored.
+        :param line: The line to log
+        :return: None
+        """
+        line = line.strip()
+        if line:
+            self.logger.log(self.log_level, line)
 
 
 ###################################################################################
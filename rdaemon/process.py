@@ -16,10 +16,11 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import re
 import os
 import sys
+import time
 import errno
+import select
 import signal
 
 
@@ -38,12 +39,17 @@ except AttributeError:
     REDIRECT_TO = "/dev/null"
 
 
-TGID_REGEXP = re.compile(r"^tgid[ \t\f\v]*:[ \t\f\v]*(\d+)\s*$", re.MULTILINE | re.IGNORECASE)
+# The number of bytes to read from /proc/<pid>/status when looking for the Tgid
+STATUS_PREFIX_SIZE = 512
 
+# Above this number of PIDs, a single listing of /proc is cheaper than checking each PID on its own
+PROC_SCAN_THRESHOLD = 16
 
-class NullDevice:
-    def write(self, s):
-        pass
+# O_PATH is Linux only
+O_PATH = getattr(os, "O_PATH", os.O_RDONLY)
+
+# A cached descriptor of /proc (see proc_pid_exists())
+_proc_fd = None
 
 
 def kill_process(pid, sig=signal.SIGTERM):
@@ -61,31 +67,59 @@ def kill_process(pid, sig=signal.SIGTERM):
         return True
 
 
-def kill_multiple_process(pids, sig=signal.SIGTERM):
+def kill_multiple_process(pids, sig=signal.SIGTERM, resolve_tgid=False):
     """
     Send a signal to a list of process.
-    --Iterating over os.kill() doesn't work well.--
+    The PIDs are expected to be processes (thread group leaders), so each one is signaled directly.
     :param pids: A list of process PIDs
     :param sig: The signal (default=SIGTERM)
+    :param resolve_tgid: If True, the PIDs may be thread IDs (see kill_multiple_tgid())
+    :return: None
+    """
+    if resolve_tgid:
+        kill_multiple_tgid(pids, sig)
+        return
+
+    __kill_all(set(pids), sig)
+
+
+def kill_multiple_tgid(tids, sig=signal.SIGTERM):
+    """
+    Send a signal to the processes of a list of threads.
+    --Iterating over os.kill() doesn't work well.--
+    Each thread ID is translated to its thread group ID (Tgid) using /proc/<pid>/status.
+    Note that /proc/<pid>/stat cannot be used for that, as it only reports the PGID.
+    :param tids: A list of thread IDs
+    :param sig: The signal (default=SIGTERM)
     :return: None
     """
     # cmd = ["kill", "-%s" % int(sig), *map(str, pids)]
     # print(" ".join(cmd))
     # subprocess.run(cmd)
+    tids = set(map(int, tids))
     group_pids = set()
-    for p in pids:
-        with open(f"/proc/{p}/status", "r") as f:
-            data = f.read()
+    if len(tids) > PROC_SCAN_THRESHOLD:
+        # A single listing of /proc reveals which of the threads are thread group leaders
+        try:
+            group_pids = tids & live_pids()
+        except OSError:
+            pass
+        tids -= group_pids
 
-        m = TGID_REGEXP.search(data)
-        if m is None:
-            tgid = p
-        else:
-            tgid = m.group(1)
-        group_pids.add(int(tgid))
+    for p in tids:
+        try:
+            # The Tgid line is near the top, so a short prefix is usually enough
+            data = __read_proc(f"{p}/status", STATUS_PREFIX_SIZE)
+            tgid = __parse_tgid(data)
+            if tgid is None and len(data) == STATUS_PREFIX_SIZE:
+                tgid = __parse_tgid(__read_proc(f"{p}/status"))
+        except FileNotFoundError:
+            # The process already terminated
+            continue
 
-    for p in group_pids:
-        kill_process(p, sig)
+        group_pids.add(p if tgid is None else tgid)
+
+    __kill_all(group_pids, sig)
 
 
 def pid_exists(pid):
@@ -120,19 +154,141 @@ def pid_exists(pid):
         return True
 
 
+def proc_pid_exists(pid):
+    """
+    Check whether pid exists using a single stat() of /proc/<pid>, relative
+    to a cached descriptor of /proc.
+    Falls back to pid_exists() if /proc is not available.
+    :param pid: The process PID
+    :return: True if the process exists
+    """
+    try:
+        os.stat(str(pid), dir_fd=__get_proc_fd())
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return pid_exists(pid)
+    else:
+        return True
+
+
+def child_running(pid):
+    """
+    Check whether a child process is running, using a single waitid().
+    The child is not reaped, so it can still be waited on (e.g., by multiprocessing.Process.join()).
+    Unlike pid_exists(), a child that exited but was not reaped yet (a zombie) is not running.
+    :param pid: The process PID
+    :return: True if running, False if exited, None if it is not a child of this process (or was reaped)
+    """
+    try:
+        return os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None
+    except ChildProcessError:
+        return None
+
+
+def open_proc_pid(pid):
+    """
+    Open a descriptor of /proc/<pid>. The descriptor refers to this specific process,
+    even if its PID is later reused.
+    :param pid: The process PID
+    :return: The descriptor, or None if /proc is not available (or the process does not exist)
+    """
+    try:
+        return os.open(str(pid), O_PATH | os.O_DIRECTORY | os.O_CLOEXEC, dir_fd=__get_proc_fd())
+    except OSError:
+        return None
+
+
+def proc_fd_alive(proc_pid_fd):
+    """
+    Check whether the process of a /proc/<pid> descriptor (see open_proc_pid()) exists,
+    without signaling it.
+    The descriptor itself stays valid after the process exits, but the entries
+    in its folder are no longer accessible.
+    :param proc_pid_fd: A descriptor of /proc/<pid>
+    :return: True if the process exists
+    """
+    try:
+        os.stat("stat", dir_fd=proc_pid_fd)
+    except OSError:
+        return False
+    return True
+
+
+def live_pids():
+    """
+    List /proc in a single pass.
+    Only thread group leaders are listed (other threads are under /proc/<pid>/task).
+    :return: A set of the PIDs of all the processes
+    """
+    with os.scandir("/proc") as it:
+        return {int(entry.name) for entry in it if entry.name.isdigit()}
+
+
+def pids_exist(pids):
+    """
+    Check which of the processes exist.
+    For many PIDs, lists /proc once instead of checking each PID.
+    :param pids: An iterable of process PIDs
+    :return: A set of the PIDs that exist
+    """
+    pids = set(pids)
+    if len(pids) > PROC_SCAN_THRESHOLD:
+        try:
+            return pids & live_pids()
+        except OSError:
+            pass
+    return {pid for pid in pids if proc_pid_exists(pid)}
+
+
+def wait_for_process_exit(pids, timeout=None):
+    """
+    Wait until at least one of the processes terminates.
+    Uses pidfd (Linux 5.3+) to be notified when a process terminates.
+    Otherwise, just sleeps for the entire timeout.
+    :param pids: A list of process PIDs
+    :param timeout: Time to wait in seconds (default: wait indefinitely)
+    :return: True if a process terminated, False otherwise
+    """
+    pidfds = []
+    try:
+        poller = select.poll()
+        for pid in pids:
+            pidfd = os.pidfd_open(pid)
+            pidfds.append(pidfd)
+            poller.register(pidfd, select.POLLIN)
+        return len(poller.poll(None if timeout is None else timeout * 1000)) > 0
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        if timeout is not None:
+            time.sleep(timeout)
+        return False
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+
 def convert_to_daemon():
     """
     Convert current process to a background daemon.
     Credit goad to Chad J. Schroeder (Copyright (C) 2005 Chad J. Schroeder)
     :return: None. Will exit if fail.
     """
-    __fork_to_child()
+    # A session leader that was re-parented to init is already detached (e.g., started by init/systemd),
+    # so only the forks are skipped
+    is_detached = os.getppid() == 1 and os.getsid(0) == os.getpid()
+
+    if not is_detached:
+        __fork_to_child()
 
     os.chdir(WORKDIR)
-    os.setsid()
+    if not is_detached:
+        os.setsid()
     os.umask(UMASK)
 
-    __fork_to_child()
+    if not is_detached:
+        __fork_to_child()
     __close_all_file_descriptors()
 
 
@@ -154,28 +310,111 @@ def __fork_to_child():
         sys.exit(1)
 
 
+def __get_proc_fd():
+    """
+    :return: A cached descriptor of /proc
+    """
+    global _proc_fd
+    if _proc_fd is None:
+        _proc_fd = os.open("/proc", O_PATH | os.O_DIRECTORY | os.O_CLOEXEC)
+    return _proc_fd
+
+
+def __read_proc(path, size=None):
+    """
+    Read a /proc file using a raw descriptor, without Python's buffered I/O.
+    :param path: The path relative to /proc (e.g., "<pid>/status")
+    :param size: The maximal number of bytes to read (default: read the entire file)
+    :return: The content as bytes
+    """
+    try:
+        proc_fd = __get_proc_fd()
+    except OSError:
+        proc_fd = None
+        path = os.path.join("/proc", path)
+
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC, dir_fd=proc_fd)
+    try:
+        if size is not None:
+            return os.read(fd, size)
+
+        chunks = []
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+
+def __kill_all(pids, sig):
+    """
+    Send a signal to each process, ignoring processes that cannot be signaled
+    (e.g., already terminated).
+    :param pids: An iterable of process PIDs
+    :param sig: The signal
+    :return: None
+    """
+    kill = os.kill
+    for p in pids:
+        try:
+            kill(p, sig)
+        except OSError:
+            pass
+
+
+def __parse_tgid(data):
+    """
+    Find the Tgid in the content of /proc/<pid>/status
+    :param data: The content (or a prefix of it) as bytes
+    :return: The Tgid, or None if a complete Tgid line was not found
+    """
+    i = data.find(b"\nTgid:")
+    if i < 0:
+        return None
+    j = data.find(b"\n", i + 6)
+    if j < 0:
+        return None
+    try:
+        return int(data[i + 6:j])
+    except ValueError:
+        return None
+
+
 def __close_all_file_descriptors():
     """
     Closes all the file descriptors of the process and redirect
-    stderr and stdout to a fake device.
-    stdin will be read from /dev/null.
+    stdin, stdout and stderr to /dev/null.
     :return: None. Will exit if fail.
     """
-    try:
-        import resource
-        maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
-        if maxfd == resource.RLIM_INFINITY:
-            maxfd = MAXFD
-    except:
-        maxfd = MAXFD
+    global _proc_fd
+    _proc_fd = None
 
-    # Iterate through and close all file descriptors.
-    for fd in range(0, maxfd):
+    try:
+        # Only the open file descriptors are listed, so there is no need to scan the entire RLIMIT range
+        maxfd = max(map(int, os.listdir("/proc/self/fd")), default=-1) + 1
+    except (OSError, ValueError):
         try:
-            os.close(fd)
-        except OSError:  # ERROR, fd wasn't open to begin with (ignored)
-            pass
+            import resource
+            maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+            if maxfd == resource.RLIM_INFINITY:
+                maxfd = MAXFD
+        except (ImportError, OSError, ValueError):
+            maxfd = MAXFD
 
-    sys.stdin = open(REDIRECT_TO, 'r')
-    sys.stderr = NullDevice()
-    sys.stdout = NullDevice()
+    # Close all file descriptors at once (uses close_range(2) where available).
+    # Errors are ignored, as most of the file descriptors weren't open to begin with.
+    os.closerange(0, maxfd)
+
+    # Redirect the standard I/O file descriptors, so writes are discarded by the kernel
+    null_fd = os.open(REDIRECT_TO, os.O_RDWR)
+    for fd in (0, 1, 2):
+        if fd != null_fd:
+            os.dup2(null_fd, fd)
+    if null_fd > 2:
+        os.close(null_fd)
+
+    sys.stdin = os.fdopen(0, 'r')
+    sys.stdout = os.fdopen(1, 'w')
+    sys.stderr = os.fdopen(2, 'w')
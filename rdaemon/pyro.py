@@ -17,10 +17,13 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import atexit
+import inspect
 import multiprocessing
+import random
 import signal
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import Pyro4
@@ -30,6 +33,7 @@ import rdaemon.bookkeeping.file as daemon_file
 from rdaemon.daemons import wrap_as_daemon, DaemonThread
 from rdaemon.interfaces import IDaemon
 from rdaemon.launch import launch_daemon
+from rdaemon.process import wait_for_process_exit, pids_exist
 from rdaemon.logging import LoggedEntity, read_logging_configuration
 from simpleconfig import SimplerConfig
 from zope.interface.declarations import implementer
@@ -255,6 +259,22 @@ class PyroDaemon(LoggedEntity):
             wrap_as_daemon(self.daemon_object, daemon_name=self.name)
 
         self.daemon_thread = DaemonThread(self.daemon_object)
+        self.bind_daemon_methods()
+
+    def bind_daemon_methods(self):
+        """
+        Bind the daemon's public methods to this object once, so calling them
+        does not go through __getattr__ on every access.
+        Only applicable for methods that are not already taken by the pyro object.
+        :return: None
+        """
+        daemon_class = type(self.daemon_object)
+        for name in dir(daemon_class):
+            if name.startswith('_') or hasattr(type(self), name) or name in self.__dict__:
+                continue
+            attr = inspect.getattr_static(daemon_class, name)
+            if callable(attr) or isinstance(attr, (staticmethod, classmethod)):
+                setattr(self, name, getattr(self.daemon_object, name))
 
     def init_pyro_daemon(self):
         """
@@ -348,6 +368,13 @@ class PyroDaemonProcess(multiprocessing.Process):
                                          ))
 
 
+# The maximal time a daemon monitor waits before checking the daemon again
+DAEMON_MONITOR_INTERVAL = 10
+
+# Repeated checks for dead daemons within this number of seconds are skipped
+CLEAR_DEAD_DAEMONS_INTERVAL = 0.1
+
+
 class PyroDaemonsDeployment(LoggedEntity):
     """
     Deploy multiple daemons
@@ -360,6 +387,9 @@ class PyroDaemonsDeployment(LoggedEntity):
         self.conf_string = conf.root.dumps()
         self.conf_sub_path = conf.sub_path
         self.active_daemons = set()
+        self.monitored_daemons = set()
+        self.daemons_exit_cond = threading.Condition()
+        self.dead_daemons_check_time = 0.
 
         self.daemon_group = daemon_group
         self.daemon_bookkeeping = daemon_bookkeeping
@@ -373,23 +403,34 @@ class PyroDaemonsDeployment(LoggedEntity):
         Deploy all the daemons that are not already deployed
         :return: None
         """
-        for daemon_name in self.deploy_daemons:
-            if daemon_name not in self.active_daemons:
-                self.deploy_daemon(daemon_name)
+        pending = [d for d in self.deploy_daemons if d not in self.active_daemons]
+        if pending:
+            # Launch the daemons in parallel, as each launch waits for its own launcher process
+            with ThreadPoolExecutor(max_workers=min(32, len(pending))) as executor:
+                list(executor.map(self.deploy_daemon, pending))
 
         services = PyroServices()
         for daemon_name in self.deploy_daemons:
             services.daemon(daemon_name, wait_timeout_sec)
+            # Only a registered daemon is guaranteed to have its PIDs in the bookkeeping
+            self.__start_monitor(daemon_name)
 
-    def clear_dead_daemons(self):
+    def clear_dead_daemons(self, force=False):
         """
-        Clear the dead daemon from the processes list
+        Clear the dead daemon from the processes list.
+        Skipped if the daemons were checked in the last CLEAR_DEAD_DAEMONS_INTERVAL seconds.
+        :param force: If True, check the daemons anyway
         :return: None
         """
-        for name in list(self.active_daemons):
-            if not self.daemon_module.is_daemon_running(daemon_name=name, sub_path=self.daemon_group):
-                self.log_warning("Daemon %s is dead", name)
-                self.active_daemons.remove(name)
+        now = time.monotonic()
+        if not force and now - self.dead_daemons_check_time < CLEAR_DEAD_DAEMONS_INTERVAL:
+            return
+
+        running = self.daemon_module.running_daemons(list(self.active_daemons), sub_path=self.daemon_group)
+        for name in self.active_daemons - running:
+            self.log_warning("Daemon %s is dead", name)
+            self.active_daemons.discard(name)
+        self.dead_daemons_check_time = now
 
     def deploy_daemon(self, daemon_name):
         """
@@ -449,16 +490,88 @@ class PyroDaemonsDeployment(LoggedEntity):
     def join(self, timeout=None, check_interval=1):
         """
         Waits for all the daemons to finish
+        :param timeout: Time to wait in seconds (default: wait indefinitely)
+        :param check_interval: The maximal time between checks of the daemons status
         :return: True if all finished
         """
-        start = time.time()
-        while timeout is None or start + timeout < time.time():
-            self.clear_dead_daemons()
-            if len(self.active_daemons) == 0:
-                return True
-            time.sleep(check_interval)
+        return self.__wait_for_exit(lambda: len(self.active_daemons) == 0, timeout, check_interval)
 
-        return False
+    def join_daemon(self, daemon_name, timeout=None, check_interval=1):
+        """
+        Waits for a daemon to finish
+        :param daemon_name: The daemon name
+        :param timeout: Time to wait in seconds (default: wait indefinitely)
+        :param check_interval: The maximal time between checks of the daemon status
+        :return: True if finished
+        """
+        return self.__wait_for_exit(lambda: daemon_name not in self.active_daemons, timeout, check_interval)
+
+    def __wait_for_exit(self, is_done, timeout, check_interval):
+        """
+        Waits until the daemons exit condition is met
+        :param is_done: Returns True when done waiting (checked after clearing the dead daemons)
+        :param timeout: Time to wait in seconds (None: wait indefinitely)
+        :param check_interval: The maximal time between checks of the daemons status
+        :return: True if done, False on timeout
+        """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        with self.daemons_exit_cond:
+            while True:
+                self.clear_dead_daemons()
+                if is_done():
+                    return True
+
+                wait_time = check_interval
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - time.monotonic())
+                    if wait_time <= 0:
+                        return False
+                # Woken up by the daemons monitors as soon as a daemon process exits
+                self.daemons_exit_cond.wait(wait_time)
+
+    def __start_monitor(self, daemon_name):
+        """
+        Start monitoring a deployed daemon (if not already monitored)
+        :param daemon_name: The daemon name
+        :return: None
+        """
+        with self.daemons_exit_cond:
+            if daemon_name in self.monitored_daemons:
+                return
+            self.monitored_daemons.add(daemon_name)
+        Thread(name="%s-monitor" % daemon_name, target=self.__monitor_daemon,
+               args=(daemon_name,), daemon=True).start()
+
+    def __monitor_daemon(self, daemon_name):
+        """
+        Waits for the daemon processes to exit, and notify the daemons exit condition.
+        Only reads the bookkeeping: the dead daemons are cleared by clear_dead_daemons().
+        :param daemon_name: The daemon name
+        :return: None
+        """
+        pids = pids_exist(self.__daemon_pids(daemon_name))
+        while pids:
+            wait_for_process_exit(pids, DAEMON_MONITOR_INTERVAL)
+            pids = pids_exist(self.__daemon_pids(daemon_name))
+
+        with self.daemons_exit_cond:
+            self.monitored_daemons.discard(daemon_name)
+            # The daemons status is changed, so the next check should not be skipped
+            self.dead_daemons_check_time = 0.
+            self.daemons_exit_cond.notify_all()
+
+    def __daemon_pids(self, daemon_name):
+        """
+        :param daemon_name: The daemon name
+        :return: A list of the PIDs of the daemon
+        """
+        try:
+            pids = self.daemon_module.get_daemon_pid(daemon_name=daemon_name, sub_path=self.daemon_group)
+        except (OSError, ValueError):
+            return []
+        if isinstance(pids, int):
+            return [pids]
+        return pids
 
 
 ###################################################################################
@@ -466,23 +579,84 @@ class PyroDaemonsDeployment(LoggedEntity):
 ###################################################################################
 
 
-def name_server_lookup(wait_timeout_sec=0):
+# The name server location is cached for this number of seconds
+NAME_SERVER_CACHE_TTL = 5
+
+_ns_cache = {"uri": None, "expires": 0.0}
+
+# Retries (of the name-server and daemon lookups) back-off exponentially between these delays
+RETRY_INITIAL_DELAY = 0.05
+RETRY_MAX_DELAY = 2
+
+
+def _retry_sleep(delay, end_time):
+    """
+    Sleep before the next retry (with a random jitter), but not beyond the end time
+    :param delay: The current retry delay
+    :param end_time: The time (see time.time()) the retries end
+    :return: The delay for the next retry
+    """
+    time.sleep(max(0., min(delay + random.random() * 0.1, end_time - time.time())))
+    return min(delay * 2, RETRY_MAX_DELAY)
+
+
+def name_server_lookup(wait_timeout_sec=0, use_cache=True):
     """
     Wait for name server to be active
     :param wait_timeout_sec: Time to wait for name server
-    :return: name server if active, raise exception otherwise
+    :param use_cache: If True, use the name server location found in the last NAME_SERVER_CACHE_TTL seconds
+    :return: name server if active, raise exception otherwise.
+        If used as a context manager, an exception in its body also clears the cached location.
     """
+    if use_cache:
+        uri = _ns_cache["uri"]
+        if uri is not None and time.monotonic() < _ns_cache["expires"]:
+            ns = Pyro4.Proxy(uri)
+            try:
+                # Connects as the first call would, so a stale location falls back to locating the name server
+                ns._pyroBind()
+                return _NameServerLookup(ns)
+            except Pyro4.errors.CommunicationError:
+                ns._pyroRelease()
+                name_server_clear_cache()
+
     end_time = time.time() + wait_timeout_sec
+    delay = RETRY_INITIAL_DELAY
     again = True
     while again:
         try:
-            return Pyro4.locateNS()
+            ns = Pyro4.locateNS()
+            _ns_cache["uri"] = ns._pyroUri
+            _ns_cache["expires"] = time.monotonic() + NAME_SERVER_CACHE_TTL
+            return _NameServerLookup(ns)
         except Exception as e:
             again = time.time() < end_time
             if not again:
                 raise e
             else:
-                time.sleep(0.5)
+                delay = _retry_sleep(delay, end_time)
+
+
+class _NameServerLookup:
+    """
+    The name server proxy returned by name_server_lookup().
+    As a context manager, it forgets the cached name server location if an exception
+    propagates from its body, so the next lookup locates the name server again.
+    """
+
+    def __init__(self, ns):
+        self.ns = ns
+
+    def __getattr__(self, name):
+        return getattr(self.ns, name)
+
+    def __enter__(self):
+        return self.ns.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            name_server_clear_cache()
+        return self.ns.__exit__(exc_type, exc_value, traceback)
 
 
 def is_name_server_alive(wait_timeout_sec=0):
@@ -492,12 +666,22 @@ def is_name_server_alive(wait_timeout_sec=0):
     :return: True if alive, False otherwise
     """
     try:
-        name_server_lookup(wait_timeout_sec)
+        name_server_lookup(wait_timeout_sec, use_cache=False)
     except Exception:
+        name_server_clear_cache()
         return False
     return True
 
 
+def name_server_clear_cache():
+    """
+    Forget the cached name server location
+    :return: None
+    """
+    _ns_cache["uri"] = None
+    _ns_cache["expires"] = 0.0
+
+
 def name_server_start(conf=None, log_conf=None):
     """
     Starts the pyro name server if it is not already active
@@ -522,6 +706,7 @@ def name_server_stop():
     Stop the name server
     :return: True if successful
     """
+    name_server_clear_cache()
     return daemon_file.kill_daemon(daemon_name='pyro-name-server', sig=signal.SIGTERM)
 
 
@@ -556,6 +741,7 @@ class PyroServices(LoggedEntity):
     def __init__(self):
         LoggedEntity.__init__(self)
         self.__daemon_uri = {}
+        self.__daemon_uri_lock = threading.Lock()
         self.__thread_daemon_object = threading.local()
 
     #################################################################
@@ -569,9 +755,15 @@ class PyroServices(LoggedEntity):
         :param daemon_name: The daemon name
         :return: The URI of the daemon if it is registered
         """
-        if daemon_name not in self.__daemon_uri:
-            self.__daemon_uri[daemon_name] = locate_daemon_uri(daemon_name, wait_timeout_sec)
-        return self.__daemon_uri[daemon_name]
+        uri = self.__daemon_uri.get(daemon_name)
+        if uri is not None:
+            return uri
+
+        # Only one thread looks up the name-server, the others use its result
+        with self.__daemon_uri_lock:
+            if daemon_name not in self.__daemon_uri:
+                self.__daemon_uri[daemon_name] = locate_daemon_uri(daemon_name, wait_timeout_sec)
+            return self.__daemon_uri[daemon_name]
 
     def create_daemon_object(self, daemon_name, wait_timeout_sec=0):
         """
@@ -594,6 +786,7 @@ class PyroServices(LoggedEntity):
             return daemons[daemon_name]
 
         end_time = time.time() + wait_timeout_sec
+        delay = RETRY_INITIAL_DELAY
         again = True
         while again:
             try:
@@ -604,7 +797,7 @@ class PyroServices(LoggedEntity):
                 if not again:
                     raise e
                 else:
-                    time.sleep(0.5)
+                    delay = _retry_sleep(delay, end_time)
 
     def async_daemon(self, daemon_name, wait_timeout_sec=0):
         """
@@ -0,0 +1,204 @@
+"""
+Author: Liran Funaro <liran.funaro@gmail.com>
+
+Copyright (C) 2006-2018 Liran Funaro
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import heapq
+import itertools
+import threading
+from time import monotonic
+
+from rdaemon.daemons import BaseDaemon, verify_object, has_finished_attribute, next_period_wakeup
+from rdaemon.interfaces import IDaemon, IPeriodicTask
+from zope.interface.declarations import implementer
+
+# With more scheduled tasks than this, tasks that are due soon are run along with the due tasks
+BATCH_THRESHOLD = 8
+
+# Tasks are run at most this number of seconds (or 10% of their period) ahead of their schedule
+BATCH_WINDOW = 0.05
+
+
+@implementer(IDaemon)
+class PeriodicScheduler(BaseDaemon):
+    """
+    Runs multiple periodic tasks in a single thread:
+     - The tasks are kept in a heap, ordered by their next wakeup.
+     - The scheduler only wakes up for the earliest wakeup.
+     - When many tasks are scheduled, each wakeup also runs the tasks that are due shortly after,
+       so close wakeups are merged into one.
+    Unlike PeriodicDaemon, that requires a thread for each task.
+    """
+
+    def __init__(self, name=None):
+        BaseDaemon.__init__(self, name=name)
+        self.tasks_lock = threading.Lock()
+        self.tasks_heap = []
+        # Set by notify(), so it is not confused with a wakeup due to a registered task
+        self.notify_requested = False
+
+        # Breaks ties between tasks with the same wakeup, so tasks are never compared
+        self.__sequence = itertools.count()
+
+    def register(self, task, wakeup_period):
+        """
+        Setup a task and schedule it periodically
+        :param task: An IPeriodicTask object
+        :param wakeup_period: The task period in seconds
+        :return: None. Raise an exception if the task cannot be setup.
+        """
+        verify_object(IPeriodicTask, task)
+        if wakeup_period <= 0:
+            raise ValueError("Wake interval must be positive. Was: %s" % wakeup_period)
+
+        # Tasks may wake up the scheduler when they finish, instead of waiting for the next period
+        if hasattr(task, "set_wakeup_func"):
+            task.set_wakeup_func(self.notify)
+        task.setup()
+        with self.tasks_lock:
+            heapq.heappush(self.tasks_heap, (monotonic() + wakeup_period, next(self.__sequence),
+                                             wakeup_period, task, has_finished_attribute(task)))
+        # Wake up the scheduler in case this is the earliest wakeup
+        self._event.set()
+
+    ###########################################################################
+    # IDaemon interface
+    ###########################################################################
+
+    def notify(self, *args, **kwargs):
+        """
+        IDaemon interface function.
+        Will run all the tasks before their next wakeup.
+        """
+        with self.tasks_lock:
+            self.notify_requested = True
+        self._event.set()
+
+    def run(self):
+        """ IDaemon interface function """
+        self.log_info("Staring %s periodic loop", self)
+        try:
+            while not self.is_terminated():
+                with self.tasks_lock:
+                    next_wakeup = self.tasks_heap[0][0] if self.tasks_heap else None
+
+                wait_time = None if next_wakeup is None else max(0, next_wakeup - monotonic())
+                is_interrupt = self._event.wait_and_clear(wait_time)
+                if self.is_terminated():
+                    break
+
+                if is_interrupt:
+                    with self.tasks_lock:
+                        notify_requested, self.notify_requested = self.notify_requested, False
+                    if notify_requested:
+                        self.__run_all_tasks()
+                    continue
+
+                self.__run_scheduled_tasks(monotonic())
+        except Exception as e:
+            self.log_exception("Exception occur during %s: %s", self, e)
+        finally:
+            self.log_info("Tearing down %s", self)
+            self.__teardown_all_tasks()
+
+        self.log_info("%s terminated", self)
+
+    ###########################################################################
+    # Internal private functions
+    ###########################################################################
+
+    def __run_scheduled_tasks(self, now):
+        """
+        Run all the tasks that their wakeup time has passed (or is within the batch window), and reschedule them.
+        Each task runs at most once in a call.
+        :param now: The current time (monotonic clock)
+        :return: None
+        """
+        rescheduled = []
+        while True:
+            with self.tasks_lock:
+                if not self.tasks_heap:
+                    break
+                wakeup, _, wakeup_period, _, _ = self.tasks_heap[0]
+                if len(self.tasks_heap) + len(rescheduled) > BATCH_THRESHOLD:
+                    wakeup -= min(BATCH_WINDOW, 0.1 * wakeup_period)
+                if wakeup > now:
+                    break
+                wakeup, seq, wakeup_period, task, read_finished = heapq.heappop(self.tasks_heap)
+
+            if not self.__run_task(task, True, read_finished):
+                continue
+
+            # Checked after the task, so missed periods are skipped rather than run back to back
+            next_wakeup = next_period_wakeup(wakeup, wakeup_period, monotonic())
+            rescheduled.append((next_wakeup, seq, wakeup_period, task, read_finished))
+
+        with self.tasks_lock:
+            for entry in rescheduled:
+                heapq.heappush(self.tasks_heap, entry)
+
+    def __run_all_tasks(self):
+        """
+        Run all the tasks due to an interrupt (keeps their schedule)
+        :return: None
+        """
+        with self.tasks_lock:
+            entries = list(self.tasks_heap)
+
+        finished = [entry for entry in entries if not self.__run_task(entry[3], False, entry[4])]
+        if not finished:
+            return
+
+        with self.tasks_lock:
+            self.tasks_heap = [entry for entry in self.tasks_heap if entry not in finished]
+            heapq.heapify(self.tasks_heap)
+
+    def __run_task(self, task, is_scheduled_wakeup, read_finished):
+        """
+        Run a task. If it is finished, tear it down.
+        :param task: The task
+        :param is_scheduled_wakeup: See IPeriodicTask
+        :param read_finished: If True, read the task's "finished" attribute instead of calling is_finished()
+        :return: True if the task should keep running
+        """
+        try:
+            task.periodic_task(is_scheduled_wakeup)
+            is_finished = task.finished if read_finished else task.is_finished()
+        except Exception as e:
+            self.log_exception("Exception occur during executing of %s: %s", task, e)
+            is_finished = False
+
+        if is_finished:
+            self.__teardown_task(task)
+        return not is_finished
+
+    def __teardown_all_tasks(self):
+        """
+        Tear down all the tasks
+        :return: None
+        """
+        with self.tasks_lock:
+            entries, self.tasks_heap = self.tasks_heap, []
+
+        for entry in entries:
+            self.__teardown_task(entry[3])
+
+    def __teardown_task(self, task):
+        """ See IPeriodicTask """
+        try:
+            task.teardown()
+        except Exception as e:
+            self.log_exception("Exception occur during teardown of %s: %s", task, e)
@@ -16,15 +16,173 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-from rdaemon.bookkeeping.file import get_daemon_pid
-from rdaemon.process import pid_exists
+import array
+import functools
+import os
+import select
+import threading
+from time import monotonic
+
+from rdaemon.bookkeeping.file import get_daemon_pid, daemon_pid_file
+from rdaemon.process import pid_exists, open_proc_pid, proc_fd_alive, child_running
 from rdaemon.logging import LoggedEntity
-from rdaemon.interfaces import IPeriodicTask
-from zope.interface.declarations import implementer
 
 
-@implementer(IPeriodicTask)
+class CheckerRegistry:
+    """
+    Waits for the daemons of all the IsAlivePeriodicChecker objects at once:
+    a single thread waits on a single epoll set of their pidfds,
+    and marks a checker as finished once its daemon terminates.
+    If pidfd is not supported, the thread checks the daemons every CHECK_INTERVAL seconds instead,
+    decoupled from the (slower) period in which the checkers are run.
+    These checks stat a pre-opened /proc/<pid> descriptor rather than signaling the daemon,
+    or use waitid() if the daemon is a child of this process.
+    """
+
+    # The interval for checking daemons that cannot be waited on with pidfd
+    CHECK_INTERVAL = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoll = None
+        self.wakeup_fds = None
+        self.checkers = {}
+        self.polled_checkers = set()
+
+    def register(self, checker):
+        """
+        Start waiting for the daemon of a checker
+        :param checker: An IsAlivePeriodicChecker object (after its PID is known)
+        :return: None
+        """
+        pidfd = _pidfd_open(checker.pid)
+        with self.lock:
+            if self.epoll is None:
+                self.__start()
+            if pidfd is None:
+                checker.is_child = child_running(checker.pid) is not None
+                checker.proc_pid_fd = open_proc_pid(checker.pid)
+                self.polled_checkers.add(checker)
+                # Wake up the thread, so it will start checking periodically
+                os.write(self.wakeup_fds[1], b"\0")
+                return
+
+            checker.pidfd = pidfd
+            self.checkers[pidfd] = checker
+            self.epoll.register(pidfd, select.EPOLLIN)
+
+    def unregister(self, checker):
+        """
+        Stop waiting for the daemon of a checker
+        :param checker: An IsAlivePeriodicChecker object (ignored if it is not registered)
+        :return: None
+        """
+        with self.lock:
+            self.__remove_polled(checker)
+            self.__remove(checker.pidfd)
+
+    def __start(self):
+        """
+        Start the waiting thread. Must be called while holding the lock.
+        :return: None
+        """
+        self.epoll = select.epoll()
+        self.wakeup_fds = os.pipe()
+        os.set_blocking(self.wakeup_fds[0], False)
+        self.epoll.register(self.wakeup_fds[0], select.EPOLLIN)
+        threading.Thread(name="is-alive-checkers", target=self.__wait_loop, daemon=True).start()
+
+    def __wait_loop(self):
+        """
+        Wait for the daemons to terminate
+        :return: None
+        """
+        next_check = monotonic()
+        while True:
+            timeout = max(0., next_check - monotonic()) if self.polled_checkers else -1
+            for fd, _ in self.epoll.poll(timeout):
+                if fd == self.wakeup_fds[0]:
+                    os.read(fd, 4096)
+                    continue
+                with self.lock:
+                    # The event may be stale: the pidfd could have been closed and its number reused
+                    # by a newly registered pidfd, so check it again before removing its checker
+                    checker = self.__remove(fd) if fd in self.checkers and _pidfd_exited(fd) else None
+                if checker is not None:
+                    checker.set_finished()
+
+            now = monotonic()
+            if self.polled_checkers and now >= next_check:
+                next_check = now + self.CHECK_INTERVAL
+                self.__check_polled_checkers()
+
+    def __check_polled_checkers(self):
+        """
+        Check the daemons that cannot be waited on with pidfd
+        :return: None
+        """
+        with self.lock:
+            checkers = list(self.polled_checkers)
+
+        for checker in checkers:
+            # A child that was already reaped is checked as any other process
+            is_alive = child_running(checker.pid) if checker.is_child else None
+            if is_alive is None:
+                if checker.proc_pid_fd is not None:
+                    is_alive = proc_fd_alive(checker.proc_pid_fd)
+                else:
+                    is_alive = pid_exists(checker.pid)
+            if not is_alive:
+                with self.lock:
+                    self.__remove_polled(checker)
+                checker.set_finished()
+
+    def __remove_polled(self, checker):
+        """
+        Stop checking a daemon that cannot be waited on with pidfd. Must be called while holding the lock.
+        :param checker: The checker
+        :return: None
+        """
+        self.polled_checkers.discard(checker)
+        if checker.proc_pid_fd is not None:
+            os.close(checker.proc_pid_fd)
+            checker.proc_pid_fd = None
+
+    def __remove(self, pidfd):
+        """
+        Remove a pidfd from the epoll set and close it. Must be called while holding the lock.
+        :param pidfd: The pidfd
+        :return: The checker of this pidfd, or None if it was already removed
+        """
+        checker = self.checkers.pop(pidfd, None)
+        if checker is None:
+            return None
+
+        checker.pidfd = None
+        self.epoll.unregister(pidfd)
+        os.close(pidfd)
+        return checker
+
+
+# Waits for the daemons of all the IsAlivePeriodicChecker objects
+CHECKERS_REGISTRY = CheckerRegistry()
+
+
 class IsAlivePeriodicChecker(LoggedEntity):
+    # Read directly by the daemons that run this task (see IPeriodicTask.is_finished())
+    finished = False
+
+    def __new__(cls, *args, **kwargs):
+        """
+        A checker without a known PID is created as a _PidFileChecker, that reads the PID on setup.
+        Also called without arguments (e.g., by copy and pickle), which keeps the class as is.
+        """
+        if cls is IsAlivePeriodicChecker and (args or kwargs):
+            pid = kwargs["pid"] if "pid" in kwargs else (args[1] if len(args) > 1 else None)
+            if pid is None:
+                cls = _PidFileChecker
+        return LoggedEntity.__new__(cls)
+
     def __init__(self, name, pid=None, pid_file=None, on_dead_daemon_func=None):
         LoggedEntity.__init__(self, name)
 
@@ -33,44 +191,84 @@ class IsAlivePeriodicChecker(LoggedEntity):
         self.pid_file = pid_file
         assert pid is not None or pid_file is not None
         self.daemon_is_dead_func = on_dead_daemon_func
-        self.finished = None
+
+        self.pidfd = None
+        self.proc_pid_fd = None
+        self.is_child = False
+        self.wakeup_func = None
 
     def setup(self):
         """ IPeriodicTask interface function """
-        if self.pid is None:
-            self.pid = get_daemon_pid(self.name, self.pid_file)
         self.finished = False
+        CHECKERS_REGISTRY.register(self)
 
     def teardown(self):
         """ IPeriodicTask interface function """
-        if self.deamon_is_dead_func:
-            self.deamon_is_dead_func()
+        CHECKERS_REGISTRY.unregister(self)
+        if self.daemon_is_dead_func is not None:
+            self.daemon_is_dead_func()
 
-    def periodic_task(self):
-        """ IPeriodicTask interface function """
-        self.finished = not self.is_alive()
+    def periodic_task(self, is_scheduled_wakeup=True):
+        """
+        IPeriodicTask interface function.
+        Nothing to do: the daemon is watched by CHECKERS_REGISTRY, that marks this checker as finished.
+        """
 
     def is_finished(self):
         """ IPeriodicTask interface function """
         return self.finished
 
+    def set_wakeup_func(self, wakeup_func):
+        """
+        Called by the daemon that runs this task (see PeriodicDaemon)
+        :param wakeup_func: Wakes up the daemon before the next period
+        :return: None
+        """
+        self.wakeup_func = wakeup_func
+
+    def set_finished(self):
+        """
+        Mark the daemon as dead, and wake up the daemon that runs this task
+        so it will not wait for the next period to tear it down.
+        :return: None
+        """
+        self.finished = True
+        if self.wakeup_func is not None:
+            self.wakeup_func()
+
     def is_alive(self):
         """
-        :return: True if the daemon is alive
+        :return: True if the daemon is alive (as watched since setup())
         """
-        return pid_exists(self.pid)
+        return not self.finished
+
+
+class _PidFileChecker(IsAlivePeriodicChecker):
+    """ Checks a daemon that its PID is read from a PID file """
+
+    def setup(self):
+        """ IPeriodicTask interface function """
+        self.pid = _read_daemon_pid(daemon_pid_file(daemon_name=self.name, pid_file=self.pid_file))
+        IsAlivePeriodicChecker.setup(self)
 
 
-@implementer(IPeriodicTask)
 class TestPeriodicTask:
     """ Test PeriodicTask counts scheduled wakups """
 
+    __slots__ = ('counter', 'target', 'done')
+
+    # Never finishes (see IPeriodicTask.is_finished())
+    finished = False
+
     def __init__(self):
-        self.counter = 0
+        # Updated in place, so each wakeup does not rebind a new int object
+        self.counter = array.array('Q', [0])
+        self.target = None
+        self.done = threading.Event()
 
     def setup(self):
         """ IPeriodicTask interface function """
-        self.counter = 0
+        self.counter[0] = 0
 
     def teardown(self):
         """ IPeriodicTask interface function """
@@ -79,7 +277,9 @@ class TestPeriodicTask:
     def periodic_task(self, is_scheduled_wakeup):
         """ IPeriodicTask interface function """
         if is_scheduled_wakeup:
-            self.counter += 1
+            self.counter[0] += 1
+            if self.target is not None and self.counter[0] >= self.target:
+                self.done.set()
 
     @staticmethod
     def is_finished():
@@ -88,4 +288,67 @@ class TestPeriodicTask:
 
     def get_count(self):
         """ :return: The number of scheduled wakeups """
-        return self.counter
+        return self.counter[0]
+
+    def wait_for_count(self, count, timeout=None):
+        """
+        Waits for the task to reach a number of scheduled wakeups
+        :param count: The number of scheduled wakeups to wait for
+        :param timeout: Time to wait in seconds (default: wait indefinitely)
+        :return: True if reached, False on timeout
+        """
+        self.done.clear()
+        self.target = count
+        if self.counter[0] >= count:
+            self.done.set()
+        return self.done.wait(timeout)
+
+
+#########################################################################
+# Module helper functions
+#########################################################################
+
+def _pidfd_open(pid):
+    """
+    :param pid: The process PID
+    :return: A pidfd of the process, or None if pidfd is not supported
+    """
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _pidfd_exited(pidfd):
+    """
+    :param pidfd: A pidfd
+    :return: True if the process of the pidfd exited (without blocking)
+    """
+    poll = select.poll()
+    poll.register(pidfd, select.POLLIN)
+    return len(poll.poll(0)) > 0
+
+
+def _read_daemon_pid(pid_file):
+    """
+    Read the daemon PID from a file. The file is parsed again only if it was modified.
+    :param pid_file: The PID file
+    :return: The PID as integer or raise error
+    """
+    try:
+        st = os.stat(pid_file)
+    except OSError:
+        raise ValueError(f"The daemon is not active. "
+                         f"No pid file named: {pid_file}") from None
+    # A PID file replaced within the timestamp granularity still differs by inode or size
+    return _read_daemon_pid_version(pid_file, (st.st_ino, st.st_size, st.st_mtime_ns))
+
+
+@functools.lru_cache(maxsize=128)
+def _read_daemon_pid_version(pid_file, _version):
+    """
+    :param pid_file: The PID file
+    :param _version: The inode, size and modification time of the file (only used as a cache key)
+    :return: The PID as integer or raise error
+    """
+    return get_daemon_pid(pid_file=pid_file)
@@ -18,6 +18,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 from setuptools import setup
 
+with open('README.md', encoding='utf-8') as f:
+    long_description = f.read()
+
 setup(
     name="rdaemon",
     version="0.1.0",
@@ -25,7 +28,7 @@ setup(
     description="Remote daemon",
     author="Liran Funaro",
     author_email="liran.funaro+rdaemon@gmail.com",
-    long_description=open('README.md').read(),
+    long_description=long_description,
     long_description_content_type='text/markdown',
     url="https://github.com/liran-funaro/remote-daemon",
     keywords='remote daemon',
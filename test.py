@@ -16,14 +16,20 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import copy
 import logging
 import os
+import pickle
+import subprocess
 import threading
 import time
 import unittest
 
+import Pyro4
+import Pyro4.util
 import rdaemon.bookkeeping.cgroups as daemon_cgroup
 import rdaemon.bookkeeping.file as daemon_file
+import rdaemon.process as daemon_process
 import rdaemon.pyro as pyro
 from rdaemon.daemons import TestCounterDaemon, TestSleeperDaemon
 from simpleconfig import SimplerConfig
@@ -31,7 +37,8 @@ from simpleconfig import SimplerConfig
 from rdaemon.logging import default_log_conf, LogManager
 
 from rdaemon.daemons import PeriodicDaemon, DaemonThread
-from rdaemon.tasks import TestPeriodicTask
+from rdaemon.scheduler import PeriodicScheduler
+from rdaemon.tasks import TestPeriodicTask, IsAlivePeriodicChecker, CheckerRegistry
 
 
 class TestCounter:
@@ -50,7 +57,8 @@ TEST_OUTPUT_PATH = "/tmp/test-pyro"
 
 
 class TestPyroDaemon(unittest.TestCase):
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         daemon_file.kill_all_daemons()
         daemon_cgroup.kill_all_daemons()
 
@@ -62,12 +70,30 @@ class TestPyroDaemon(unittest.TestCase):
         pyro.name_server_start(log_conf=log_conf)
         LogManager.init_logger("unit-test", **log_conf)
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         pyro.name_server_stop()
 
         daemon_file.kill_all_daemons()
         daemon_cgroup.kill_all_daemons()
 
+    def setUp(self):
+        self.kill_test_daemons()
+
+        # The name server is shared by all the tests, so only clear what previous tests registered
+        with pyro.name_server_lookup(30) as ns:
+            for name in ns.list():
+                if name != 'Pyro.NameServer':
+                    ns.remove(name)
+
+    def tearDown(self):
+        self.kill_test_daemons()
+
+    @staticmethod
+    def kill_test_daemons():
+        daemon_file.kill_all_daemons(exclude=['pyro-name-server'])
+        daemon_cgroup.kill_all_daemons()
+
     def get_base_config(self):
         conf = SimplerConfig()
         conf.globals.logging.verbosity = logging.DEBUG
@@ -252,7 +278,7 @@ class TestPyroDaemon(unittest.TestCase):
             self.assertTrue(deploy.is_all_running())
 
             deploy.terminate_daemon("test.counter1")
-            time.sleep(2)
+            self.assertTrue(deploy.join_daemon("test.counter1", timeout=10))
             self.assertFalse(deploy.is_all_running())
         finally:
             deploy.terminate_all()
@@ -349,6 +375,29 @@ class TestPyroDaemon(unittest.TestCase):
             counter.terminate()
             counter.join()
 
+    def test_daemon_proxy_serialization(self):
+        counter_object = TestCounter()
+        counter = pyro.PyroDaemonThread("test.counter", counter_object)
+        counter.start()
+
+        try:
+            services = pyro.PyroServices()
+            counter_proxy = services.daemon("test.counter", 3)
+            counter_proxy.add()
+
+            # Proxies can be passed as arguments of remote calls
+            serializer = Pyro4.util.get_serializer("serpent")
+            copies = [pickle.loads(pickle.dumps(counter_proxy)),
+                      serializer.loads(serializer.dumps(counter_proxy))]
+            for proxy_copy in copies:
+                self.assertIs(type(proxy_copy), Pyro4.Proxy)
+                self.assertEqual(proxy_copy._pyroUri, counter_proxy._pyroUri)
+                with proxy_copy:
+                    self.assertEqual(proxy_copy.count(), 1)
+        finally:
+            counter.terminate()
+            counter.join()
+
     def test_pyro_daemon_thread_with_non_daemon_class(self):
         counter_object = TestCounter()
         counter = pyro.PyroDaemonThread("test.counter", counter_object)
@@ -372,6 +421,108 @@ class TestPyroDaemon(unittest.TestCase):
                 pass
 
 
+class SlowPeriodicTask(TestPeriodicTask):
+    """ Records the time of each wakeup. The first scheduled wakeup overruns the period. """
+
+    def __init__(self, first_duration):
+        TestPeriodicTask.__init__(self)
+        self.first_duration = first_duration
+        self.wakeup_times = []
+
+    def periodic_task(self, is_scheduled_wakeup):
+        if not is_scheduled_wakeup:
+            return
+        self.wakeup_times.append(time.monotonic())
+        if len(self.wakeup_times) == 1:
+            time.sleep(self.first_duration)
+        TestPeriodicTask.periodic_task(self, is_scheduled_wakeup)
+
+    def wakeup_gaps(self):
+        return [t2 - t1 for t1, t2 in zip(self.wakeup_times, self.wakeup_times[1:])]
+
+
+class UnitTestProcess(unittest.TestCase):
+
+    def test_convert_detached_process_to_daemon(self):
+        detached_exit_code = 3
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # Simulate a session leader that was re-parented to init
+                os.setsid()
+                os.getppid = lambda: 1
+                fd = os.open(os.devnull, os.O_RDONLY)
+
+                daemon_process.convert_to_daemon()
+                # A forked child would have exited the original process with 0
+                try:
+                    os.fstat(fd)
+                except OSError:
+                    if os.readlink("/proc/self/fd/1") == os.devnull and os.getcwd() == "/":
+                        os._exit(detached_exit_code)
+            finally:
+                os._exit(1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), detached_exit_code)
+
+
+class UnitTestLogging(unittest.TestCase):
+
+    def test_log_from_forked_process(self):
+        LogManager.stop_logging()
+        if not os.path.isdir(TEST_OUTPUT_PATH):
+            os.makedirs(TEST_OUTPUT_PATH)
+        log_file = os.path.join(TEST_OUTPUT_PATH, "unit-test-fork.log")
+        if os.path.exists(log_file):
+            os.remove(log_file)
+
+        LogManager.init_logger("unit-test-fork", output_path=TEST_OUTPUT_PATH)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                logging.getLogger("unit-test").info("Logged from a forked process")
+                os._exit(0)
+            os.waitpid(pid, 0)
+        finally:
+            LogManager.stop_logging()
+
+        with open(log_file) as f:
+            self.assertEqual(f.read().count("Logged from a forked process"), 1)
+
+
+class UnitTestCheckerRegistry(unittest.TestCase):
+
+    def start_checker(self, registry):
+        proc = subprocess.Popen(["sleep", "60"])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        checker = IsAlivePeriodicChecker("test.checker", pid=proc.pid)
+        checker.finished = False
+        is_dead = threading.Event()
+        checker.set_wakeup_func(is_dead.set)
+        registry.register(checker)
+        self.addCleanup(registry.unregister, checker)
+        return proc, checker, is_dead
+
+    def test_checker_registry(self):
+        registry = CheckerRegistry()
+        checkers = [self.start_checker(registry) for _ in range(3)]
+
+        proc, checker, is_dead = checkers[1]
+        proc.kill()
+        self.assertTrue(is_dead.wait(5))
+        self.assertFalse(checker.is_alive())
+        registry.unregister(checker)
+
+        # A new checker may reuse the descriptor number of the removed checker
+        checkers.append(self.start_checker(registry))
+        time.sleep(0.5)
+        for proc, checker, is_dead in checkers[:1] + checkers[2:]:
+            self.assertTrue(checker.is_alive())
+            self.assertFalse(is_dead.is_set())
+
+
 class UnitTestPeriodicTask(unittest.TestCase):
 
     def test_periodic_task(self):
@@ -381,8 +532,123 @@ class UnitTestPeriodicTask(unittest.TestCase):
 
         expected_count = 5
         daemon_thread.start()
-        time.sleep(expected_count)
+        self.assertTrue(task.wait_for_count(expected_count, expected_count + 1))
         daemon_thread.terminate()
         count = task.get_count()
         self.assertGreaterEqual(count, expected_count - 1)
         self.assertLessEqual(count, expected_count + 1)
+
+    def test_periodic_task_overrun(self):
+        task = SlowPeriodicTask(first_duration=2.5)
+        daemon = PeriodicDaemon(task, 1)
+        daemon_thread = DaemonThread(daemon)
+
+        daemon_thread.start()
+        self.assertTrue(task.wait_for_count(3, 8))
+        daemon_thread.terminate()
+
+        # The missed periods are skipped, rather than run back to back
+        gaps = task.wakeup_gaps()
+        self.assertGreaterEqual(min(gaps), 0.5)
+        self.assertAlmostEqual(gaps[0], 3, delta=0.5)
+
+    def test_is_alive_checker(self):
+        proc = subprocess.Popen(["sleep", "60"])
+        is_dead = threading.Event()
+        checker = IsAlivePeriodicChecker("test.checker", pid=proc.pid, on_dead_daemon_func=is_dead.set)
+        daemon_thread = DaemonThread(PeriodicDaemon(checker, 1))
+
+        daemon_thread.start()
+        try:
+            # Survives scheduled wakeups while the daemon is alive
+            self.assertFalse(is_dead.wait(1.5))
+            self.assertTrue(checker.is_alive())
+
+            proc.terminate()
+            proc.wait()
+            self.assertTrue(is_dead.wait(5))
+            self.assertFalse(checker.is_alive())
+        finally:
+            proc.kill()
+            daemon_thread.terminate()
+
+    def test_is_alive_checker_copy(self):
+        for checker in (IsAlivePeriodicChecker("test.checker", pid=os.getpid()),
+                        IsAlivePeriodicChecker("test.checker", pid_file="/tmp/test.pid")):
+            for checker_copy in (copy.copy(checker), pickle.loads(pickle.dumps(checker))):
+                self.assertIs(type(checker_copy), type(checker))
+                self.assertEqual(checker_copy.pid, checker.pid)
+                self.assertEqual(checker_copy.pid_file, checker.pid_file)
+
+    def test_is_alive_checker_replaced_pid_file(self):
+        pid_file = f"/tmp/test-checker-{os.getpid()}.pid"
+        self.addCleanup(os.remove, pid_file)
+        with open(pid_file, "w") as f:
+            f.write("1")
+        mtime = os.stat(pid_file).st_mtime_ns
+        checker = IsAlivePeriodicChecker("test.checker", pid_file=pid_file)
+        checker.setup()
+        self.addCleanup(checker.teardown)
+        self.assertEqual(checker.pid, 1)
+
+        # Replaced with another PID file that has the same modification time
+        with open(pid_file + ".new", "w") as f:
+            f.write(str(os.getpid()))
+        os.utime(pid_file + ".new", ns=(mtime, mtime))
+        os.rename(pid_file + ".new", pid_file)
+        checker = IsAlivePeriodicChecker("test.checker", pid_file=pid_file)
+        checker.setup()
+        self.addCleanup(checker.teardown)
+        self.assertEqual(checker.pid, os.getpid())
+
+    def test_periodic_scheduler(self):
+        task_1 = TestPeriodicTask()
+        task_2 = TestPeriodicTask()
+        scheduler = PeriodicScheduler()
+        scheduler.register(task_1, 1)
+        scheduler.register(task_2, 2)
+        scheduler_thread = DaemonThread(scheduler)
+
+        expected_count = 6
+        scheduler_thread.start()
+        self.assertTrue(task_2.wait_for_count(expected_count // 2, expected_count + 2))
+        scheduler_thread.terminate()
+        count_1 = task_1.get_count()
+        count_2 = task_2.get_count()
+        self.assertGreaterEqual(count_1, expected_count - 1)
+        self.assertLessEqual(count_1, expected_count + 1)
+        self.assertGreaterEqual(count_2, expected_count // 2 - 1)
+        self.assertLessEqual(count_2, expected_count // 2 + 1)
+
+    def test_periodic_scheduler_notify_with_register(self):
+        proc = subprocess.Popen(["sleep", "60"])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        is_dead = threading.Event()
+        checker = IsAlivePeriodicChecker("test.checker", pid=proc.pid, on_dead_daemon_func=is_dead.set)
+        scheduler = PeriodicScheduler()
+        scheduler_thread = DaemonThread(scheduler)
+
+        # The registration and the notification arrive before the scheduler wakes up
+        scheduler.register(checker, 60)
+        checker.set_finished()
+        scheduler_thread.start()
+        try:
+            self.assertTrue(is_dead.wait(5))
+        finally:
+            scheduler_thread.terminate()
+
+    def test_periodic_scheduler_overrun(self):
+        task = SlowPeriodicTask(first_duration=2.5)
+        scheduler = PeriodicScheduler()
+        scheduler.register(task, 1)
+        scheduler_thread = DaemonThread(scheduler)
+
+        scheduler_thread.start()
+        self.assertTrue(task.wait_for_count(3, 8))
+        scheduler_thread.terminate()
+
+        # The missed periods are skipped, rather than run back to back
+        gaps = task.wakeup_gaps()
+        self.assertGreaterEqual(min(gaps), 0.5)
+        self.assertAlmostEqual(gaps[0], 3, delta=0.5)